@@ -0,0 +1,304 @@
+import os
+import time
+import random
+import timeit
+import shutil
+import sqlite3
+import argparse
+import operator
+import tracemalloc
+from q1 import GithubRecord, QueryHandler, MULTI_VALUE_COLUMNS, count_multi_value_sql, load_partitions, discover_years, analyse_partition, hash_table, EncodedSurvey, AggregateSpec, AggregateResult, SURVEY_AGGREGATES, get_worked_with_programming_languages, get_interested_in_programming_languages, get_worked_with_dbms, get_interested_in_dbms, get_countries, get_education_level_by_years, get_main_branches, get_main_branch_representation_by_years, top_k, SpaceSaving
+
+MAIN_BRANCHES = ["I am a developer by profession", "I am learning to code", "I code primarily as a hobby", "I am not primarily a developer, but I write code sometimes as part of my work/studies", "I used to be a developer by profession, but no longer am"]
+COUNTRIES = ["South Africa", "United States of America", "Germany", "India", "Brazil", "United Kingdom of Great Britain and Northern Ireland", None]
+EDUCATION_LEVELS = ["Bachelor's degree (B.A., B.S., B.Eng., etc.)", "Master's degree (M.A., M.S., M.Eng., MBA, etc.)", "Some college/university study without earning a degree", "Secondary school (e.g. American high school, German Realschule or Gymnasium, etc.)"]
+LANGUAGES = ["Python", "JavaScript", "HTML/CSS", "SQL", "Java", "C#", "C++", "TypeScript", "Rust", "Go", "PHP", "Bash/Shell"]
+DBMS = ["PostgreSQL", "MySQL", "SQLite", "MongoDB", "Microsoft SQL Server", "Redis", "MariaDB", "Oracle"]
+AGES = ["18-24 years old", "25-34 years old", "35-44 years old", "45-54 years old", "Under 18 years old"]
+
+class DictGithubRecord:
+ #The pre-__slots__ layout, kept as the baseline for the memory benchmark
+ def __init__(self, year, years_of_experience, main_branch, country, education_level, languages_worked_with, languages_interested_in, dbms_worked_with, dbms_interested_in, age):
+  self.year = year
+  self.years_of_experience = years_of_experience
+  self.main_branch = main_branch
+  self.country = country
+  self.education_level = education_level
+  self.languages_worked_with = languages_worked_with
+  self.languages_interested_in = languages_interested_in
+  self.dbms_worked_with = dbms_worked_with
+  self.dbms_interested_in = dbms_interested_in
+  self.age = age
+
+#The per-field get_* scans, the baseline the single-pass and SQL aggregations are checked against
+multi_value_counters = {
+ "languages_worked_with": get_worked_with_programming_languages,
+ "languages_interested_in": get_interested_in_programming_languages,
+ "dbms_worked_with": get_worked_with_dbms,
+ "dbms_interested_in": get_interested_in_dbms
+}
+
+def aggregate_records(data: list[GithubRecord], specs: list[AggregateSpec]) -> AggregateResult:
+ #The record-based single scan EncodedSurvey.aggregate replaced, every spec counted per year in one pass over the records
+ counts_by_year: dict[str, dict[int, dict[str, int]]] = {spec.name: dict() for spec in specs}
+ compiled = [(counts_by_year[spec.name], operator.attrgetter(spec.field), spec.multi_value) for spec in specs]
+ year = None
+ for entry in data:
+  if entry.year != year:
+   year = entry.year
+   targets = [(tables.setdefault(year, dict()), getter, multi_value) for tables, getter, multi_value in compiled]
+  for counts, getter, multi_value in targets:
+   value = getter(entry)
+   if not multi_value:
+    counts[value] = counts.get(value, 0) + 1
+   elif value is not None:
+    for item in value.split(";"):
+     counts[item] = counts.get(item, 0) + 1
+ return AggregateResult(counts_by_year)
+
+def fresh(value):
+ #sqlite3 hands out a new string object per cell, copy so interning has something to share
+ return None if value is None else value.encode().decode()
+
+def generate_multi_value(generator: random.Random, values: list[str]) -> str:
+ if generator.random() < 0.1:
+  return None
+ return ";".join(generator.sample(values, generator.randint(1, 5)))
+
+def generate_survey_rows(count: int, seed: int = 0):
+ generator = random.Random(seed)
+ for _ in range(count):
+  yield (
+   generator.choice((2021, 2022, 2023)),
+   fresh(str(generator.randint(0, 40))),
+   fresh(generator.choice(MAIN_BRANCHES)),
+   fresh(generator.choice(COUNTRIES)),
+   fresh(generator.choice(EDUCATION_LEVELS)),
+   generate_multi_value(generator, LANGUAGES),
+   generate_multi_value(generator, LANGUAGES),
+   generate_multi_value(generator, DBMS),
+   generate_multi_value(generator, DBMS),
+   fresh(generator.choice(AGES))
+  )
+
+def measure_peak(build) -> tuple[int, list]:
+ tracemalloc.start()
+ result = build()
+ peak = tracemalloc.get_traced_memory()[1]
+ tracemalloc.stop()
+ return peak, result
+
+def benchmark_record_memory(count: int = 1000000):
+ print(f"{'layout':>10} {'peak':>12}")
+ for name, record_type in (("__dict__", DictGithubRecord), ("__slots__", GithubRecord)):
+  peak, records = measure_peak(lambda: [record_type(*fields) for fields in generate_survey_rows(count)])
+  del records
+  print(f"{name:>10} {peak / (1 << 20):>10.1f}MB")
+ #Retained size rather than peak, building the codes needs the rows once either way
+ rows = list(generate_survey_rows(count))
+ tracemalloc.start()
+ before = tracemalloc.get_traced_memory()[0]
+ survey = EncodedSurvey.from_rows(2021, [[row[1:] for row in rows]])
+ retained = tracemalloc.get_traced_memory()[0] - before
+ tracemalloc.stop()
+ del survey
+ print(f"{'encoded':>10} {retained / (1 << 20):>10.1f}MB")
+
+SURVEY_COLUMNS = ["YearsCode", "MainBranch", "Country", "EdLevel", "LanguageHaveWorkedWith", "LanguageWantToWorkWith", "DatabaseHaveWorkedWith", "DatabaseWantToWorkWith", "Age"]
+SURVEY_QUERY = "SELECT YearsCode, MainBranch, Country, EdLevel, LanguageHaveWorkedWith, LanguageWantToWorkWith, DatabaseHaveWorkedWith, DatabaseWantToWorkWith, Age FROM data_{}"
+SURVEY_YEARS = (2021, 2022, 2023)
+
+def write_synthetic_survey(file_path: str, count: int, seed: int = 0):
+ if os.path.exists(file_path):
+  os.remove(file_path)
+ connection = sqlite3.connect(file_path)
+ for year in SURVEY_YEARS:
+  connection.execute(f"CREATE TABLE data_{year} ({', '.join(column + ' TEXT' for column in SURVEY_COLUMNS)})")
+ generator = random.Random(seed)
+ for row in generate_survey_rows(count, seed):
+  row = list(row)
+  if generator.random() < 0.05:
+   row[2] = "None of these"
+  connection.execute(f"INSERT INTO data_{row[0]} VALUES ({', '.join('?' * len(SURVEY_COLUMNS))})", row[1:])
+ connection.commit()
+ connection.close()
+
+def benchmark_sql_aggregation(count: int = 2500000, file_path: str = "benchmark_survey.db"):
+ #Default is roughly ten times the three survey years combined
+ if not os.path.exists(file_path):
+  write_synthetic_survey(file_path, count)
+ query_handler = QueryHandler(file_path)
+
+ start_time = time.perf_counter()
+ data = [GithubRecord.from_record(year, entry) for year in SURVEY_YEARS for entry in query_handler.execute_atomic_query(SURVEY_QUERY.format(year))]
+ valid_subset = [entry for entry in data if entry.validate()]
+ load_time = time.perf_counter() - start_time
+ start_time = time.perf_counter()
+ python_counts = {(field, year): multi_value_counters[field](valid_subset, year) for field in MULTI_VALUE_COLUMNS for year in SURVEY_YEARS}
+ python_time = time.perf_counter() - start_time
+ del data, valid_subset
+
+ start_time = time.perf_counter()
+ sql_counts = {(field, year): count_multi_value_sql(query_handler, field, year) for field in MULTI_VALUE_COLUMNS for year in SURVEY_YEARS}
+ sql_time = time.perf_counter() - start_time
+
+ assert python_counts == sql_counts
+ print(f"python: {load_time:.3f}s load + {python_time:.3f}s counting = {load_time + python_time:.3f}s")
+ print(f"sqlite: {sql_time:.3f}s ({(load_time + python_time) / sql_time:.2f}x)")
+
+def benchmark_load(count: int = 1000000, file_path: str = "benchmark_survey.db"):
+ if not os.path.exists(file_path):
+  write_synthetic_survey(file_path, count)
+
+ def fetch_all():
+  query_handler = QueryHandler(file_path)
+  return [GithubRecord.from_record(year, entry) for year in SURVEY_YEARS for entry in query_handler.execute_atomic_query(SURVEY_QUERY.format(year))]
+ def stream():
+  query_handler = QueryHandler(file_path, read_only=True)
+  data = []
+  for year in SURVEY_YEARS:
+   data.extend(query_handler.iterate_query(SURVEY_QUERY.format(year), row_factory=GithubRecord.row_factory(year)))
+  return data
+
+ def encoded():
+  #One worker, the other loaders read one table at a time too
+  return load_partitions(file_path, SURVEY_YEARS, [], 1)[0]
+
+ print(f"{'loader':>10} {'time':>10} {'peak':>12}")
+ for name, load in (("fetchall", fetch_all), ("fetchmany", stream), ("encoded", encoded)):
+  start_time = time.perf_counter()
+  peak, records = measure_peak(load)
+  elapsed = time.perf_counter() - start_time
+  del records
+  print(f"{name:>10} {elapsed:>9.3f}s {peak / (1 << 20):>10.1f}MB")
+
+def benchmark_partitions(count: int = 1000000, file_path: str = "benchmark_survey.db", directory: str = "benchmark_extract"):
+ if not os.path.exists(file_path):
+  write_synthetic_survey(file_path, count)
+ working_path = file_path + ".partitions"
+ shutil.copyfile(file_path, working_path)
+ shutil.rmtree(directory, ignore_errors=True)
+
+ def analyse() -> tuple[float, dict]:
+  start_time = time.perf_counter()
+  query_handler = QueryHandler(working_path, read_only=True)
+  survey = load_partitions(working_path, discover_years(query_handler), SURVEY_AGGREGATES, None, directory)[1]
+  return time.perf_counter() - start_time, survey.counts_by_year
+
+ cold_time, _ = analyse()
+ warm_time, _ = analyse()
+ #A new year arrives, the cached years are only re-hashed, not re-analysed
+ connection = sqlite3.connect(working_path)
+ connection.execute("CREATE TABLE data_2024 AS SELECT * FROM data_2023")
+ connection.commit()
+ connection.close()
+ added_time, counts_by_year = analyse()
+ query_handler = QueryHandler(working_path, read_only=True)
+ assert counts_by_year == load_partitions(working_path, discover_years(query_handler), SURVEY_AGGREGATES)[1].counts_by_year
+ print(f"cold: {cold_time:.3f}s")
+ print(f"cached: {warm_time:.3f}s ({cold_time / warm_time:.2f}x)")
+ print(f"new year added: {added_time:.3f}s")
+ #What that is made of: each cached year is re-hashed once, the new year is analysed from scratch
+ for year in discover_years(query_handler):
+  start_time = time.perf_counter()
+  hash_table(query_handler, year)
+  print(f"  revalidate data_{year}: {time.perf_counter() - start_time:.3f}s")
+ start_time = time.perf_counter()
+ analyse_partition(working_path, 2024, SURVEY_AGGREGATES)
+ print(f"  analyse data_2024 alone: {time.perf_counter() - start_time:.3f}s")
+
+ #Uncached, one year per worker: threads against processes against one table at a time
+ years = discover_years(query_handler)
+ timings = dict()
+ for name, workers, processes in (("serial", 1, False), ("threads", None, False), ("processes", None, True)):
+  start_time = time.perf_counter()
+  assert load_partitions(working_path, years, SURVEY_AGGREGATES, workers, None, processes)[1].counts_by_year == counts_by_year
+  timings[name] = time.perf_counter() - start_time
+ for name, elapsed in timings.items():
+  print(f"{name}: {elapsed:.3f}s ({timings['serial'] / elapsed:.2f}x) on {os.cpu_count()} CPUs")
+ os.remove(working_path)
+ shutil.rmtree(directory)
+
+def benchmark_single_pass(count: int = 1000000):
+ data = sorted((GithubRecord(*fields) for fields in generate_survey_rows(count)), key=lambda entry: entry.year)
+ data = [entry for entry in data if entry.validate()]
+
+ #The same calls q1.py made before the aggregation engine, one scan each
+ start_time = time.perf_counter()
+ separate = {(field, year): multi_value_counters[field](data, year) for year in SURVEY_YEARS for field in MULTI_VALUE_COLUMNS}
+ countries = get_countries(data)
+ education_levels = get_education_level_by_years(data)
+ main_branches = [get_main_branches(data, year) for year in SURVEY_YEARS]
+ get_main_branch_representation_by_years(data)
+ get_main_branch_representation_by_years(data)
+ separate_time = time.perf_counter() - start_time
+
+ start_time = time.perf_counter()
+ survey = aggregate_records(data, SURVEY_AGGREGATES)
+ survey.representation_by_years("main_branches", SURVEY_YEARS)
+ survey.representation_by_years("main_branches", SURVEY_YEARS)
+ single_time = time.perf_counter() - start_time
+
+ encoded = EncodedSurvey.from_records(data)
+ start_time = time.perf_counter()
+ encoded_survey = encoded.aggregate(SURVEY_AGGREGATES)
+ encoded_survey.representation_by_years("main_branches", SURVEY_YEARS)
+ encoded_survey.representation_by_years("main_branches", SURVEY_YEARS)
+ encoded_time = time.perf_counter() - start_time
+
+ assert separate == {(field, year): survey.counts(field, year) for year in SURVEY_YEARS for field in MULTI_VALUE_COLUMNS}
+ assert countries == survey.counts("countries")
+ assert education_levels == survey.counts_by_years("education_levels", SURVEY_YEARS)
+ assert main_branches == survey.counts_by_years("main_branches", SURVEY_YEARS)
+ print(f"separate passes: {separate_time:.3f}s")
+ assert encoded_survey.counts_by_year == survey.counts_by_year
+ print(f"single pass: {single_time:.3f}s ({separate_time / single_time:.2f}x)")
+ print(f"encoded: {encoded_time:.3f}s ({separate_time / encoded_time:.2f}x)")
+
+def benchmark_ranking(count: int = 2000000, capacity: int = 1000, k: int = 5):
+ #Zipf-like answers over a large vocabulary, the shape free-text responses have
+ generator = random.Random(0)
+ items = [f"answer {int(generator.paretovariate(0.7))}" for _ in range(count)]
+ counts: dict[str, int] = dict()
+ for item in items:
+  counts[item] = counts.get(item, 0) + 1
+
+ #Best of three, the first call over a fresh dict also pays for a garbage collection pass
+ sort_time = min(timeit.repeat(lambda: sorted(counts.items(), key=lambda item: item[1], reverse=True)[:k], number=1, repeat=3))
+ heap_time = min(timeit.repeat(lambda: top_k(counts, k), number=1, repeat=3))
+ expected = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:k]
+ exact = top_k(counts, k)
+ assert [(item.label, item.count) for item in exact] == expected
+
+ counter = SpaceSaving(capacity)
+ start_time = time.perf_counter()
+ for item in items:
+  counter.add(item)
+ approximate = counter.top(k)
+ approximate_time = time.perf_counter() - start_time
+ print(f"vocabulary: {len(counts)}, counters: {capacity}, error bound: {counter.total // capacity}")
+ print(f"sorted: {sort_time * 1000:.2f}ms")
+ print(f"heapq top-{k}: {heap_time * 1000:.2f}ms ({sort_time / heap_time:.2f}x)")
+ print(f"space-saving: {approximate_time:.3f}s streaming, {sum(item.label == label for item, (label, _) in zip(approximate, expected))}/{k} ranks exact")
+ for item in approximate:
+  print(f"  {item.label}: {item.count - item.error}..{item.count} (true {counts[item.label]})")
+
+if __name__ == "__main__":
+ parser = argparse.ArgumentParser()
+ parser.add_argument("benchmark", nargs="?", choices=("memory", "sql", "passes", "load", "ranking", "partitions"), default="memory")
+ parser.add_argument("--rows", type=int)
+ parser.add_argument("--database", default="benchmark_survey.db")
+ arguments = parser.parse_args()
+
+ if arguments.benchmark == "sql":
+  benchmark_sql_aggregation(arguments.rows or 2500000, arguments.database)
+ elif arguments.benchmark == "load":
+  benchmark_load(arguments.rows or 1000000, arguments.database)
+ elif arguments.benchmark == "partitions":
+  benchmark_partitions(arguments.rows or 1000000, arguments.database)
+ elif arguments.benchmark == "ranking":
+  benchmark_ranking(arguments.rows or 2000000)
+ elif arguments.benchmark == "passes":
+  benchmark_single_pass(arguments.rows or 1000000)
+ else:
+  benchmark_record_memory(arguments.rows or 1000000)
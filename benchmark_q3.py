@@ -0,0 +1,337 @@
+import os
+import csv
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import datetime
+import platform
+import resource
+import subprocess
+import tracemalloc
+import multiprocessing
+import concurrent.futures
+import q3
+from q3 import SentimentKeywordLookup, SentimentMatcher, ChatGPTRating, sentiment_engines, parse_created_on, CREATED_ON_FORMAT
+
+FILLER = ["the", "app", "is", "it", "open", "answers", "my", "questions", "and", "but", "sometimes", "very", "literally", "unlikely", "to", "use"]
+
+def generate_reviews(count: int, keywords: list[str], seed: int = 0) -> list[str]:
+    generator = random.Random(seed)
+    return [
+        " ".join(
+            generator.choice(keywords) if generator.random() < 0.2 else generator.choice(FILLER)
+            for _ in range(generator.randint(1, 40))
+        )
+        for _ in range(count)
+    ]
+
+def time_call(function, reviews: list[str]) -> float:
+    start_time = time.perf_counter()
+    for review in reviews:
+        function(review)
+    return time.perf_counter() - start_time
+
+def benchmark_sentiment_matcher(review_count: int = 20000):
+    positive = list(SentimentKeywordLookup.POSITIVE)
+    negative = list(SentimentKeywordLookup.NEGATIVE)
+    reviews = generate_reviews(review_count, positive + negative)
+    print(f"{'keywords':>8} {'count()':>10} {'matcher':>10} {'speedup':>8}")
+    for fraction in (0.1, 0.25, 0.5, 1.0):
+        subset_positive = positive[:max(1, int(len(positive) * fraction))]
+        subset_negative = negative[:max(1, int(len(negative) * fraction))]
+        matcher = SentimentMatcher(subset_positive, subset_negative)
+        scan = lambda review: (
+            sum(review.count(word) for word in subset_positive),
+            sum(review.count(word) for word in subset_negative)
+        )
+        for review in reviews:
+            assert scan(review) == matcher.count(review), review
+        scan_time = time_call(scan, reviews)
+        matcher_time = time_call(matcher.count, reviews)
+        print(f"{len(subset_positive) + len(subset_negative):>8} {scan_time:>9.3f}s {matcher_time:>9.3f}s {scan_time / matcher_time:>7.2f}x")
+
+def generate_timestamps(count: int, distinct: int, seed: int = 0) -> list[str]:
+    generator = random.Random(seed)
+    start = datetime.datetime(2023, 1, 1)
+    minutes = [start + datetime.timedelta(minutes=generator.randrange(60 * 24 * 365 * 2)) for _ in range(distinct)]
+    return [
+        f"{moment.month}/{moment.day}/{moment.year} {moment.hour}:{moment.minute:02d}"
+        for moment in (generator.choice(minutes) for _ in range(count))
+    ]
+
+def benchmark_created_on_parser(count: int = 200000):
+    print(f"{'distinct':>8} {'strptime':>10} {'uncached':>10} {'cached':>10}")
+    for distinct in (100, 10000, count):
+        timestamps = generate_timestamps(count, distinct)
+        for timestamp in timestamps[:1000]:
+            assert parse_created_on(timestamp) == datetime.datetime.strptime(timestamp, CREATED_ON_FORMAT), timestamp
+        strptime_time = time_call(lambda timestamp: datetime.datetime.strptime(timestamp, CREATED_ON_FORMAT), timestamps)
+        uncached_time = time_call(parse_created_on.__wrapped__, timestamps)
+        parse_created_on.cache_clear()
+        cached_time = time_call(parse_created_on, timestamps)
+        print(f"{distinct:>8} {strptime_time:>9.3f}s {uncached_time:>9.3f}s {cached_time:>9.3f}s")
+
+class DictChatGPTRating:
+    #The pre-__slots__ layout, kept as the baseline for the memory benchmark
+    def __init__(self, id, username, content, score, likes, created_version, created_on, current_version, sentiment):
+        self.id = id
+        self.username = username
+        self.content = content
+        self.score = score
+        self.likes = likes
+        self.created_version = created_version
+        self.created_on = created_on
+        self.current_version = current_version
+        self.sentiment = sentiment
+
+def generate_rating_fields(count: int, seed: int = 0):
+    generator = random.Random(seed)
+    start = datetime.datetime(2023, 1, 1)
+    for index in range(count):
+        #Fresh string objects per row, like csv.reader hands out
+        yield (
+            uuid.UUID(int=generator.getrandbits(128)),
+            " ".join(["A", "Google", "user"]) if generator.random() < 0.5 else f"user{index}",
+            " ".join(generator.choice(FILLER) for _ in range(generator.randint(1, 20))),
+            generator.randint(1, 5),
+            generator.randint(0, 100),
+            f"1.{generator.randint(2023, 2024)}.{generator.randint(1, 60)}",
+            start + datetime.timedelta(minutes=generator.randrange(60 * 24 * 365)),
+            f"1.{generator.randint(2023, 2024)}.{generator.randint(1, 60)}",
+            generator.randint(0, 2)
+        )
+
+def measure_peak(build) -> tuple[int, list]:
+    tracemalloc.start()
+    result = build()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, result
+
+def benchmark_rating_memory(count: int = 1000000):
+    print(f"{'layout':>10} {'peak':>12}")
+    for name, record_type in (("__dict__", DictChatGPTRating), ("__slots__", ChatGPTRating)):
+        peak, ratings = measure_peak(lambda: [record_type(*fields) for fields in generate_rating_fields(count)])
+        del ratings
+        print(f"{name:>10} {peak / (1 << 20):>10.1f}MB")
+
+def load_reviews(file_path: str) -> list[str]:
+    with open(file_path, "r", encoding="utf-8") as file_handler:
+        reader = csv.reader(file_handler)
+        next(reader)
+        return [row[2].lower() for row in reader]
+
+def benchmark_sentiment_engines(reviews: list[str]):
+    sentiments = dict()
+    print(f"{'engine':>10} {'time':>10} {'reviews/s':>12}")
+    for name in sentiment_engines:
+        analyse = lambda review: ChatGPTRating.analyse_sentiment(review, name)
+        engine_time = time_call(analyse, reviews)
+        sentiments[name] = [analyse(review) for review in reviews]
+        print(f"{name:>10} {engine_time:>9.3f}s {len(reviews) / engine_time:>12.0f}")
+    names = list(sentiments)
+    for index, name in enumerate(names):
+        for other_name in names[index + 1:]:
+            agreeing = sum(a == b for a, b in zip(sentiments[name], sentiments[other_name]))
+            print(f"{name} vs {other_name}: {agreeing}/{len(reviews)} ({agreeing / max(1, len(reviews)):.1%}) agree")
+
+CORPUS_HEADER = ["reviewId", "userName", "content", "score", "thumbsUpCount", "reviewCreatedVersion", "at", "appVersion"]
+CORPUS_VERSIONS = [f"1.2024.{minor:03d}" for minor in range(1, 60)]
+
+def generate_review(generator: random.Random, keywords: list[str]) -> str:
+    #Mostly a handful of words with a long tail of essays, roughly one word in six is a sentiment keyword
+    length = max(1, min(400, int(generator.lognormvariate(1.8, 1.0))))
+    words = [generator.choice(keywords) if generator.random() < 0.15 else generator.choice(FILLER) for _ in range(length)]
+    if generator.random() < 0.3:
+        words[0] = words[0].capitalize()
+    review = " ".join(words)
+    if generator.random() < 0.01:
+        review = review.replace(" ", "\n", 1) + ' "quoted"'
+    return review
+
+def write_synthetic_corpus(file_path: str, rows: int, seed: int = 0):
+    generator = random.Random(seed)
+    keywords = SentimentKeywordLookup.POSITIVE + SentimentKeywordLookup.NEGATIVE
+    #Reviews ramp up over the release period and cluster on a limited pool of minutes, like the real dump
+    start = datetime.datetime(2023, 5, 18)
+    span_minutes = 60 * 24 * 600
+    minute_pool = [int(span_minutes * math.sqrt(generator.random())) for _ in range(max(1, rows // 20))]
+    with open(file_path, "w", encoding="utf-8", newline="") as file_handler:
+        writer = csv.writer(file_handler)
+        writer.writerow(CORPUS_HEADER)
+        for index in range(rows):
+            moment = start + datetime.timedelta(minutes=generator.choice(minute_pool))
+            created_version = generator.choice(CORPUS_VERSIONS)
+            writer.writerow([
+                uuid.UUID(int=generator.getrandbits(128), version=4),
+                "A Google user" if generator.random() < 0.5 else f"user{index}",
+                generate_review(generator, keywords),
+                generator.choices((1, 2, 3, 4, 5), (10, 3, 5, 12, 70))[0],
+                0 if generator.random() < 0.9 else generator.randint(1, 500),
+                created_version,
+                f"{moment.month}/{moment.day}/{moment.year} {moment.hour}:{moment.minute:02d}",
+                created_version if generator.random() < 0.7 else generator.choice(CORPUS_VERSIONS)
+            ])
+
+def corpus_path(directory: str, rows: int, seed: int) -> str:
+    file_path = os.path.join(directory, f"chatgpt_reviews_{rows}_{seed}.csv")
+    if not os.path.exists(file_path):
+        os.makedirs(directory, exist_ok=True)
+        write_synthetic_corpus(file_path + ".tmp", rows, seed)
+        os.replace(file_path + ".tmp", file_path)
+    return file_path
+
+def read_rows(file_path: str) -> list[list[str]]:
+    with open(file_path, "r", encoding="utf-8") as file_handler:
+        return list(q3.setup_reader(file_handler))
+
+def stage_read_ratings(file_path: str) -> float:
+    start_time = time.perf_counter()
+    q3.read_ratings(file_path)
+    return time.perf_counter() - start_time
+
+def stage_from_row(file_path: str) -> float:
+    rows = read_rows(file_path)
+    start_time = time.perf_counter()
+    for row in rows:
+        ChatGPTRating.from_row(row)
+    return time.perf_counter() - start_time
+
+def stage_analyse_sentiment(file_path: str, engine: str) -> float:
+    contents = [row[2].lower() for row in read_rows(file_path)]
+    start_time = time.perf_counter()
+    for content in contents:
+        ChatGPTRating.analyse_sentiment(content, engine)
+    return time.perf_counter() - start_time
+
+def stage_get_sentiment_by_month(file_path: str) -> float:
+    ratings = q3.read_ratings(file_path)
+    start_time = time.perf_counter()
+    q3.get_sentiment_by_month(ratings)
+    return time.perf_counter() - start_time
+
+def stage_convert_ratings(file_path: str) -> float:
+    ratings = q3.read_ratings(file_path)
+    start_time = time.perf_counter()
+    q3.convert_ratings(ratings)
+    return time.perf_counter() - start_time
+
+def stage_stream_sentiment_by_month(file_path: str) -> float:
+    start_time = time.perf_counter()
+    q3.stream_sentiment_by_month(file_path)
+    return time.perf_counter() - start_time
+
+STAGES = {
+    "read_ratings": stage_read_ratings,
+    "from_row": stage_from_row,
+    "analyse_sentiment[substring]": lambda file_path: stage_analyse_sentiment(file_path, "substring"),
+    "analyse_sentiment[token]": lambda file_path: stage_analyse_sentiment(file_path, "token"),
+    "get_sentiment_by_month": stage_get_sentiment_by_month,
+    "convert_ratings": stage_convert_ratings,
+    "stream_sentiment_by_month": stage_stream_sentiment_by_month
+}
+
+def run_stage(stage: str, file_path: str) -> tuple[float, int]:
+    #Runs in a fresh process so ru_maxrss is this stage's own peak
+    seconds = STAGES[stage](file_path)
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def benchmark_suite(sizes: list[int], stages: list[str], corpus_directory: str, results_path: str, seed: int = 0) -> list[dict]:
+    commit = current_commit()
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for rows in sizes:
+        file_path = corpus_path(corpus_directory, rows, seed)
+        for stage in stages:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                seconds, peak_rss = executor.submit(run_stage, stage, file_path).result()
+            result = {
+                "commit": commit,
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "rows": rows,
+                "stage": stage,
+                "seconds": seconds,
+                "rows_per_second": rows / seconds if seconds > 0 else 0.0,
+                "peak_rss_bytes": peak_rss
+            }
+            print(f"{rows:>10} {stage:>30} {seconds:>9.3f}s {result['rows_per_second']:>12.0f} rows/s {peak_rss / (1 << 20):>9.1f}MB")
+            results.append(result)
+            with open(results_path, "a", encoding="utf-8") as results_handler:
+                results_handler.write(json.dumps(result) + "\n")
+    return results
+
+def compare_results(results: list[dict], baseline_path: str, threshold: float) -> bool:
+    baseline = dict()
+    with open(baseline_path, "r", encoding="utf-8") as baseline_handler:
+        for line in baseline_handler:
+            if line.strip():
+                result = json.loads(line)
+                baseline[(result["rows"], result["stage"])] = result
+    regressed = False
+    for result in results:
+        previous = baseline.get((result["rows"], result["stage"]))
+        if previous is None:
+            continue
+        throughput = result["rows_per_second"] / previous["rows_per_second"] if previous["rows_per_second"] > 0 else 1.0
+        memory = result["peak_rss_bytes"] / previous["peak_rss_bytes"] if previous["peak_rss_bytes"] > 0 else 1.0
+        flag = throughput < 1 - threshold or memory > 1 + threshold
+        regressed = regressed or flag
+        print(f"{result['rows']:>10} {result['stage']:>30} throughput {throughput:>6.2f}x memory {memory:>6.2f}x vs {previous['commit']}{'  REGRESSION' if flag else ''}")
+    return not regressed
+
+def check_checkpoint(directory: str, rows: int = 2000, seed: int = 0):
+    #The file grows the way an export being written does, every --checkpoint run must match a full scan
+    corpus = open(corpus_path(directory, rows, seed), "rb").read()
+    header_end = corpus.index(b"\n") + 1
+    middle = corpus.index(b"\n", len(corpus) // 2)
+    file_path = os.path.join(directory, "checkpoint_check.csv")
+    checkpoint_path = file_path + ".checkpoint"
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    for name, end in (("empty", 0), ("partial header", header_end // 2), ("header", header_end), ("unterminated row", middle), ("half", middle + 1), ("full", len(corpus))):
+        with open(file_path, "wb") as file_handler:
+            file_handler.write(corpus[:end])
+        expected = q3.stream_sentiment_by_month(file_path) if end >= header_end else dict()
+        assert q3.update_sentiment_by_month(file_path, checkpoint_path) == expected, name
+        print(f"checkpoint after {name}: {sum(map(sum, expected.values()))} reviews")
+    os.remove(file_path)
+    os.remove(checkpoint_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", nargs="?", choices=("micro", "suite", "checkpoint"), default="micro")
+    parser.add_argument("--corpus", default="data/chatgpt_reviews.csv")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000, 10000000])
+    parser.add_argument("--stages", nargs="+", choices=STAGES.keys(), default=list(STAGES))
+    parser.add_argument("--corpus-directory", default="benchmarks")
+    parser.add_argument("--results", default="benchmark_results.jsonl")
+    parser.add_argument("--compare")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    if arguments.benchmark == "checkpoint":
+        check_checkpoint(arguments.corpus_directory, seed=arguments.seed)
+    elif arguments.benchmark == "suite":
+        results = benchmark_suite(arguments.sizes, arguments.stages, arguments.corpus_directory, arguments.results, arguments.seed)
+        if arguments.compare is not None and not compare_results(results, arguments.compare, arguments.threshold):
+            sys.exit(1)
+    else:
+        benchmark_sentiment_matcher()
+        benchmark_created_on_parser()
+        benchmark_rating_memory()
+        if os.path.exists(arguments.corpus):
+            benchmark_sentiment_engines(load_reviews(arguments.corpus))
+        else:
+            benchmark_sentiment_engines(generate_reviews(20000, SentimentKeywordLookup.POSITIVE + SentimentKeywordLookup.NEGATIVE))
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import functools
+import tracemalloc
+
+class SpanStatistics:
+    path: str
+    calls: int
+    total_ns: int
+    max_ns: int
+    rows: int
+    memory_peak: int
+
+    def __init__(self, path: str):
+        self.path = path
+        self.calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.rows = 0
+        self.memory_peak = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "path": self.path,
+            "calls": self.calls,
+            "total_ms": self.total_ns / 1e6,
+            "mean_ms": self.total_ns / 1e6 / max(1, self.calls),
+            "max_ms": self.max_ns / 1e6,
+            "rows": self.rows,
+            "rows_per_second": self.rows / (self.total_ns / 1e9) if self.total_ns > 0 else 0.0,
+            "memory_peak_bytes": self.memory_peak
+        }
+
+class Span:
+    path: str
+    start_ns: int
+    rows: int
+    memory_start: int
+    memory_high: int
+
+    def __init__(self, path: str):
+        self.path = path
+        self.start_ns = 0
+        self.rows = 0
+        self.memory_start = 0
+        self.memory_high = 0
+
+class Profiler:
+    enabled: bool
+    track_memory: bool
+    report_path: str
+    local: threading.local
+    main_stack: list[Span]
+    lock: threading.Lock
+    statistics: dict[str, SpanStatistics]
+
+    def __init__(self):
+        self.enabled = False
+        self.track_memory = False
+        self.report_path = None
+        self.local = threading.local()
+        self.main_stack = self.local.stack = []
+        self.lock = threading.Lock()
+        self.statistics = dict()
+
+    def active(self) -> bool:
+        return self.enabled
+
+    def stack(self) -> list[Span]:
+        #Every thread nests spans on a stack of its own, they only meet in the shared statistics
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def enter(self, name: str) -> Span:
+        stack = self.stack()
+        if stack:
+            parent = stack[-1].path
+        else:
+            #A worker thread's outermost span hangs under whatever the main thread has open, the call waiting on it
+            parent = next((span.path for span in self.main_stack[-1:]), None)
+        active = Span(f"{parent}/{name}" if parent is not None else name)
+        if self.track_memory and stack is self.main_stack:
+            #tracemalloc only keeps one global peak, fold it into the enclosing span before resetting it for this one.
+            #With one process-wide peak there is nothing to attribute to a worker thread, its spans report no memory
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].memory_high = max(stack[-1].memory_high, peak)
+            tracemalloc.reset_peak()
+            active.memory_start = current
+            active.memory_high = current
+        stack.append(active)
+        active.start_ns = time.perf_counter_ns()
+        return active
+
+    def exit(self, active: Span):
+        elapsed_ns = time.perf_counter_ns() - active.start_ns
+        stack = self.stack()
+        stack.pop()
+        with self.lock:
+            if active.path not in self.statistics:
+                self.statistics[active.path] = SpanStatistics(active.path)
+            statistics = self.statistics[active.path]
+            statistics.calls += 1
+            statistics.total_ns += elapsed_ns
+            statistics.max_ns = max(statistics.max_ns, elapsed_ns)
+            statistics.rows += active.rows
+            if self.track_memory and stack is self.main_stack:
+                active.memory_high = max(active.memory_high, tracemalloc.get_traced_memory()[1])
+                statistics.memory_peak = max(statistics.memory_peak, active.memory_high - active.memory_start)
+                if stack:
+                    stack[-1].memory_high = max(stack[-1].memory_high, active.memory_high)
+
+    def report(self) -> list[dict]:
+        return [statistics.as_dict() for statistics in self.statistics.values()]
+
+    def write_report(self):
+        if self.report_path is None:
+            for statistics in self.report():
+                print(f"{statistics['path']}: {statistics['calls']} calls, {statistics['total_ms']:.3f}ms, {statistics['rows']} rows, {statistics['memory_peak_bytes']} bytes peak", file=sys.stderr)
+            return
+        with open(self.report_path, "w", encoding="utf-8") as report_handler:
+            json.dump(self.report(), report_handler, indent=4)
+
+profiler = Profiler()
+#Process pool workers would profile into a copy nobody reports, their time shows in the span that waits on them instead
+os.register_at_fork(after_in_child=lambda: setattr(profiler, "enabled", False))
+
+def enable(report_path: str = None, track_memory: bool = False):
+    profiler.enabled = True
+    profiler.report_path = report_path
+    profiler.track_memory = track_memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    atexit.register(profiler.write_report)
+
+def add_rows(rows: int):
+    if profiler.active():
+        stack = profiler.stack()
+        if stack:
+            stack[-1].rows += rows
+
+def timing(function):
+    @functools.wraps(function)
+    def wrap(*args, **kw):
+        if not profiler.active():
+            return function(*args, **kw)
+        active = profiler.enter(function.__name__)
+        try:
+            return function(*args, **kw)
+        finally:
+            profiler.exit(active)
+    return wrap
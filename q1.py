@@ -1,11 +1,23 @@
 import os
+import sys
+import json
+import zlib
+import heapq
+import marshal
+import base64
+import hashlib
 import sqlite3
+import array
 import zipfile
-import matplotlib.pyplot as plt
-
-if not os.path.exists("data/github.db"):
-    with zipfile.ZipFile("data/data.zip") as file:
-        file.extractall("data")
+import argparse
+import concurrent.futures
+import urllib.parse
+import operator
+import itertools
+import numpy as np
+import instrumentation
+import rendering
+from instrumentation import timing
 
 class Point:
  x: float
@@ -31,52 +43,104 @@ class Bar:
   self.label = label
   self.value = value
 
-def create_line_graph(lines: list[Line], file_path: str):
- plt.clf()
- for line in lines:
-  xs = [point.x for point in line.points]
-  ys = [point.y for point in line.points]
-  plt.plot(xs, ys, label = line.label)
- plt.legend(bbox_to_anchor=(0.5, -0.1), loc='upper center')
- plt.savefig(file_path, bbox_inches="tight")
-
-def create_bar_graph(labels: tuple[str, str], bars: list[Bar], file_path: str):
- plt.clf()
- plt.bar(
-  [
-   bar.label 
-   for bar in bars
-  ],
-  [
-   bar.value
-   for bar in bars
-  ]
- )
- plt.xlabel(labels[0])
- plt.ylabel(labels[1])
- 
- plt.savefig(file_path)
-
 class QueryHandler:
+ #Read-only connections get these; mmap lets SQLite read pages without copying them through its own cache
+ READ_ONLY_PRAGMAS = {
+  "query_only": 1,
+  "mmap_size": 1 << 30,
+  "cache_size": -65536,
+  "temp_store": "MEMORY"
+ }
+ BATCH_SIZE = 4096
  file_path: str
  connection: sqlite3.Connection
 
- def __init__(self, file_path: str):
+ def __init__(self, file_path: str, read_only: bool = False):
   self.file_path = file_path
-  self.connection = sqlite3.connect(file_path)
+  if read_only:
+   #sqlite3 keeps a prepared statement per distinct SQL text, so bound parameters reuse the same statement
+   self.connection = sqlite3.connect(f"file:{urllib.parse.quote(file_path)}?mode=ro", uri=True, cached_statements=256)
+   for pragma, value in QueryHandler.READ_ONLY_PRAGMAS.items():
+    self.connection.execute(f"PRAGMA {pragma} = {value}")
+  else:
+   self.connection = sqlite3.connect(file_path, cached_statements=256)
 
  def __del__(self):
   self.connection.close()
  
- def execute_atomic_query(self, query_template: str, *args) -> list[any]:
+ @timing
+ def execute_atomic_query(self, query_template: str, *args, parameters: tuple = ()) -> list[any]:
   query = query_template.format(*args)
   cursor = self.connection.cursor()
-  result = cursor.execute(query)
-  return result.fetchall()
+  result = cursor.execute(query, parameters).fetchall()
+  instrumentation.add_rows(len(result))
+  return result
+
+ def iterate_batches(self, query: str, parameters: tuple = (), row_factory = None, batch_size: int = None):
+  #Rows come out in fetchmany batches, so only one batch of tuples is alive at a time
+  cursor = self.connection.cursor()
+  cursor.row_factory = row_factory
+  cursor.execute(query, parameters)
+  try:
+   while True:
+    rows = cursor.fetchmany(batch_size or QueryHandler.BATCH_SIZE)
+    if not rows:
+     break
+    instrumentation.add_rows(len(rows))
+    yield rows
+  finally:
+   cursor.close()
+
+ def iterate_query(self, query: str, parameters: tuple = (), row_factory = None, batch_size: int = None):
+  for rows in self.iterate_batches(query, parameters, row_factory, batch_size):
+   yield from rows
+
+def intern_value(value):
+ #Survey answers repeat across respondents, share one copy of each string
+ return sys.intern(value) if isinstance(value, str) else value
+
+#Sanitising rules as data, a future survey year adds entries here rather than code in the record loop
+SURVEY_EXCLUSIONS: dict[str, tuple] = {
+ "country": (None,),
+ "main_branch": ("None of these",)
+}
+SURVEY_REMAPS: dict[str, dict[str, str]] = {
+ #1.1.2 (4 marks)
+ "country": {
+  "Congo, Republic of the...": "Democratic Republic of the Congo",
+  "Democratic People's Republic of Korea": "North Korea",
+  "Republic of Korea": "South Korea",
+  "Saudi Arabia": "United Arab Emirates"
+ },
+ #1.1.4 (3 marks)
+ "main_branch": {
+  "I am not primarily a developer, but I write code sometimes as part of my work": "I am not primarily a developer, but I write code sometimes as part of my work/studies",
+  "I am a student who is learning to code": "I am learning to code"
+ }
+}
+SURVEY_COLUMNS: dict[str, str] = {
+ "years_of_experience": "YearsCode",
+ "main_branch": "MainBranch",
+ "country": "Country",
+ "education_level": "EdLevel",
+ "languages_worked_with": "LanguageHaveWorkedWith",
+ "languages_interested_in": "LanguageWantToWorkWith",
+ "dbms_worked_with": "DatabaseHaveWorkedWith",
+ "dbms_interested_in": "DatabaseWantToWorkWith",
+ "age": "Age"
+}
+
+def sql_literal(value) -> str:
+ return "NULL" if value is None else "'" + str(value).replace("'", "''") + "'"
+
+def sql_validity(exclusions: dict[str, tuple]) -> str:
+ #SURVEY_EXCLUSIONS as a WHERE clause, for queries that filter inside SQLite
+ return " AND ".join(f"{SURVEY_COLUMNS[field]} IS NOT {sql_literal(value)}" for field, excluded in exclusions.items() for value in excluded)
 
 class GithubRecord: #forward declaration
  pass
 class GithubRecord:
+ __slots__ = ("year", "years_of_experience", "main_branch", "country", "education_level", "languages_worked_with", "languages_interested_in", "dbms_worked_with", "dbms_interested_in", "age")
  year: int
  years_of_experience: int
  main_branch: str
@@ -85,44 +149,36 @@ class GithubRecord:
  languages_worked_with: str
  languages_interested_in: str
  dbms_worked_with: str
- dbms_interested_int: str
+ dbms_interested_in: str
  age: int
 
  def __init__(self, year: int, years_of_experience: int, main_branch: str, country: str, education_level: str, languages_worked_with: str, languages_interested_in: str, dbms_worked_with: str, dbms_interested_in: str, age: str):
   self.year = year
-  self.years_of_experience = years_of_experience
-  self.main_branch = main_branch
-  self.country = country
-  self.education_level = education_level
-  self.languages_worked_with = languages_worked_with
-  self.languages_interested_in = languages_interested_in
-  self.dbms_worked_with = dbms_worked_with
-  self.dbms_interested_in = dbms_interested_in
-  self.age = age
+  self.years_of_experience = intern_value(years_of_experience)
+  self.main_branch = intern_value(main_branch)
+  self.country = intern_value(country)
+  self.education_level = intern_value(education_level)
+  self.languages_worked_with = intern_value(languages_worked_with)
+  self.languages_interested_in = intern_value(languages_interested_in)
+  self.dbms_worked_with = intern_value(dbms_worked_with)
+  self.dbms_interested_in = intern_value(dbms_interested_in)
+  self.age = intern_value(age)
 
  def from_record(year: int, data: tuple) -> GithubRecord:
   return GithubRecord(year, *data)
+
+ def row_factory(year: int):
+  #Builds records straight from the cursor, skipping the intermediate tuple list
+  return lambda cursor, row: GithubRecord(year, *row)
  
  def validate(self) -> bool:
-  return self.country is not None and self.main_branch != "None of these"
+  return all(getattr(self, field) not in excluded for field, excluded in SURVEY_EXCLUSIONS.items())
  def conform(self):
-  #1.1.2 (4 marks)
-  match self.country:
-   case "Congo, Republic of the...":
-    self.country = "Democratic Republic of the Congo"
-   case "Democratic People's Republic of Korea":
-    self.country = "North Korea"
-   case "Republic of Korea":
-    self.country = "South Korea"
-   case "Saudi Arabia":
-    self.country = "United Arab Emirates"
-  #1.1.4 (3 marks)
-  match self.main_branch:
-   case "I am not primarily a developer, but I write code sometimes as part of my work":
-    self.main_branch = "I am not primarily a developer, but I write code sometimes as part of my work/studies"
-   case "I am a student who is learning to code":
-    self.main_branch = "I am learning to code"
+  for field, remaps in SURVEY_REMAPS.items():
+   value = getattr(self, field)
+   setattr(self, field, remaps.get(value, value))
 
+@timing
 def get_countries(data: list[GithubRecord]) -> dict:
  countries = dict()
  for entry in data:
@@ -130,17 +186,22 @@ def get_countries(data: list[GithubRecord]) -> dict:
    countries[entry.country] += 1
   else:
    countries[entry.country] = 1
+ instrumentation.add_rows(len(data))
  return countries
 
-def get_education_level_by_years(data: list[GithubRecord]) -> list[dict]:
- education_levels: list[dict[str, int]] = [dict(), dict(), dict()]
+@timing
+def get_education_level_by_years(data: list[GithubRecord], years: list[int]=None) -> list[dict]:
+ years = sorted({entry.year for entry in data}) if years is None else years
+ education_levels: dict[int, dict[str, int]] = {year: dict() for year in years}
  for entry in data:
-  if entry.education_level in education_levels[entry.year - 2021]:
-   education_levels[entry.year - 2021][entry.education_level] += 1
+  if entry.education_level in education_levels[entry.year]:
+   education_levels[entry.year][entry.education_level] += 1
   else:
-   education_levels[entry.year - 2021][entry.education_level] = 1
- return education_levels
+   education_levels[entry.year][entry.education_level] = 1
+ instrumentation.add_rows(len(data))
+ return [education_levels[year] for year in years]
 
+@timing
 def get_main_branches(data: list[GithubRecord], year: int) -> dict:
  main_branches = dict()
  for entry in (entry for entry in data if entry.year == year):
@@ -148,8 +209,10 @@ def get_main_branches(data: list[GithubRecord], year: int) -> dict:
    main_branches[entry.main_branch] += 1
   else:
    main_branches[entry.main_branch] = 1
+ instrumentation.add_rows(len(data))
  return main_branches
 
+@timing
 def get_worked_with_programming_languages(data: list[GithubRecord], year: int=None) -> dict[str, int]:
  worked_with_programming_languages: dict[str, int] = dict()
  for entry in (entry for entry in data if (year is None or entry.year == year) and entry.languages_worked_with is not None):
@@ -158,7 +221,9 @@ def get_worked_with_programming_languages(data: list[GithubRecord], year: int=No
     worked_with_programming_languages[programming_language] += 1
    else:
     worked_with_programming_languages[programming_language] = 1
+ instrumentation.add_rows(len(data))
  return worked_with_programming_languages
+@timing
 def get_interested_in_programming_languages(data: list[GithubRecord], year: int=None) -> dict[str, int]:
  interested_in_programming_languages: dict[str, int] = dict()
  for entry in (entry for entry in data if (year is None or entry.year == year) and entry.languages_interested_in is not None):
@@ -167,7 +232,9 @@ def get_interested_in_programming_languages(data: list[GithubRecord], year: int=
     interested_in_programming_languages[programming_language] += 1
    else:
     interested_in_programming_languages[programming_language] = 1
+ instrumentation.add_rows(len(data))
  return interested_in_programming_languages
+@timing
 def get_worked_with_dbms(data: list[GithubRecord], year: int=None) -> dict[str, int]:
  worked_with_dbms: dict[str, int] = dict()
  for entry in (entry for entry in data if (year is None or entry.year == year) and entry.dbms_worked_with is not None):
@@ -176,7 +243,9 @@ def get_worked_with_dbms(data: list[GithubRecord], year: int=None) -> dict[str,
     worked_with_dbms[dbms] += 1
    else:
     worked_with_dbms[dbms] = 1
+ instrumentation.add_rows(len(data))
  return worked_with_dbms
+@timing
 def get_interested_in_dbms(data: list[GithubRecord], year: int=None) -> dict[str, int]:
  interested_in_dbms: dict[str, int] = dict()
  for entry in (entry for entry in data if (year is None or entry.year == year) and entry.dbms_interested_in is not None):
@@ -185,198 +254,771 @@ def get_interested_in_dbms(data: list[GithubRecord], year: int=None) -> dict[str
      interested_in_dbms[dbms] += 1
     else:
      interested_in_dbms[dbms] = 1
+ instrumentation.add_rows(len(data))
  return interested_in_dbms
 
-def get_main_branch_representation_by_years(data: list[GithubRecord]):
- return [{k: v for k, v in sorted(get_main_branches(data, year).items(), key=lambda item: item[1])} for year in range(2021, 2024)]
+class AggregateSpec:
+ name: str
+ field: str
+ multi_value: bool
 
-query_handler = QueryHandler("data/Github.db")
-#data = query_handler.execute_atomic_query("SELECT name, sql FROM sqlite_master WHERE type='table'")
+ def __init__(self, name: str, field: str, multi_value: bool = False):
+  self.name = name
+  self.field = field
+  self.multi_value = multi_value
 
-query_format = "SELECT YearsCode, MainBranch, Country, EdLevel, LanguageHaveWorkedWith, LanguageWantToWorkWith, DatabaseHaveWorkedWith, DatabaseWantToWorkWith, Age FROM data_{}"
-data_by_year: list[list[GithubRecord]] = [
- [GithubRecord.from_record(year, entry) for entry in query_handler.execute_atomic_query(query_format.format(year))]
- for year in range(2021, 2024)
+class AggregateResult:
+ pass
+class AggregateResult:
+ counts_by_year: dict[str, dict[int, dict[str, int]]]
+
+ def __init__(self, counts_by_year: dict[str, dict[int, dict[str, int]]]):
+  self.counts_by_year = counts_by_year
+
+ def counts(self, name: str, year: int=None) -> dict[str, int]:
+  if year is not None:
+   return dict(self.counts_by_year[name].get(year, dict()))
+  #Years are merged in order, the same first-seen key order a single scan over year-ordered data gives
+  counts: dict[str, int] = dict()
+  for year in sorted(self.counts_by_year[name]):
+   for key, count in self.counts_by_year[name][year].items():
+    counts[key] = counts.get(key, 0) + count
+  return counts
+
+ def merge(results: list[AggregateResult]) -> AggregateResult:
+  #Partitions cover disjoint years, merging is just collecting their per-year tables
+  counts_by_year: dict[str, dict[int, dict[str, int]]] = dict()
+  for result in results:
+   for name, tables in result.counts_by_year.items():
+    counts_by_year.setdefault(name, dict()).update(tables)
+  return AggregateResult(counts_by_year)
+
+ def counts_by_years(self, name: str, years: list[int]) -> list[dict[str, int]]:
+  return [self.counts(name, year) for year in years]
+
+ def representation_by_years(self, name: str, years: list[int]) -> list[dict[str, int]]:
+  return [{k: v for k, v in sorted(counts.items(), key=lambda item: item[1])} for counts in self.counts_by_years(name, years)]
+
+SURVEY_AGGREGATES = [
+ AggregateSpec("countries", "country"),
+ AggregateSpec("education_levels", "education_level"),
+ AggregateSpec("main_branches", "main_branch"),
+ AggregateSpec("languages_worked_with", "languages_worked_with", True),
+ AggregateSpec("languages_interested_in", "languages_interested_in", True),
+ AggregateSpec("dbms_worked_with", "dbms_worked_with", True),
+ AggregateSpec("dbms_interested_in", "dbms_interested_in", True)
 ]
-data = data_by_year[0] + data_by_year[1] + data_by_year[2] #1.1.1 (4 marks)
 
-#Sanitise (1.1.3)
-valid_subset = [entry for entry in data if entry.validate()]
-for entry in valid_subset:
- entry.conform()
+class RankedItem:
+ label: str
+ count: int
+ error: int
+
+ def __init__(self, label: str, count: int, error: int = 0):
+  self.label = label
+  self.count = count
+  self.error = error
 
+ def __repr__(self) -> str:
+  return f"RankedItem({self.label!r}, {self.count}, {self.error})"
 
-"""
-2.1.1.1 (5 Marks)
-"""
-main_branch_representation_by_years = get_main_branch_representation_by_years(valid_subset)
-a = list(
- [year_data[key] for year_data in main_branch_representation_by_years]
-
- for key in set(
-  key 
-  for keys in (
-   year_data.keys() 
-   for year_data in 
-    main_branch_representation_by_years
-  )
-  for key in keys
- )
-)
-#print(a)
-# create_graph()
+def top_k(counts: dict[str, int], k: int) -> list[RankedItem]:
+ #nlargest keeps sorted()'s tie order, without sorting the whole vocabulary
+ return [RankedItem(label, count) for label, count in heapq.nlargest(k, counts.items(), key=operator.itemgetter(1))]
 
+class SpaceSaving:
+ #Bounded-memory heavy hitters: each count overestimates the true one by at most its error, and no error exceeds total / capacity
+ capacity: int
+ total: int
+ counters: dict[str, list[int]]
+ heap: list[tuple[int, int, str]]
+ sequence: itertools.count
 
-"""
-2.1.2.1
+ def __init__(self, capacity: int):
+  self.capacity = capacity
+  self.total = 0
+  self.counters = dict()
+  self.heap = []
+  self.sequence = itertools.count()
+
+ def add(self, item: str, count: int = 1):
+  self.total += count
+  counter = self.counters.get(item)
+  if counter is not None:
+   counter[0] += count
+  elif len(self.counters) < self.capacity:
+   counter = self.counters[item] = [count, 0]
+  else:
+   #The newcomer takes over the smallest counter, whose count becomes its possible overestimate
+   floor = self.counters.pop(self.pop_minimum())[0]
+   counter = self.counters[item] = [floor + count, floor]
+  heapq.heappush(self.heap, (counter[0], next(self.sequence), item))
+  if len(self.heap) > 4 * self.capacity:
+   self.heap = [(counter[0], next(self.sequence), item) for item, counter in self.counters.items()]
+   heapq.heapify(self.heap)
+
+ def pop_minimum(self) -> str:
+  #Heap entries go stale as counts grow, only one matching the live count is a real minimum
+  while True:
+   count, _, item = heapq.heappop(self.heap)
+   counter = self.counters.get(item)
+   if counter is not None and counter[0] == count:
+    return item
+
+ def update(self, items):
+  for item, count in items:
+   self.add(item, count)
+
+ def top(self, k: int) -> list[RankedItem]:
+  return [RankedItem(item, count, error) for item, (count, error) in heapq.nlargest(k, self.counters.items(), key=lambda entry: entry[1][0])]
+
+def ranking_bars(ranking: list[RankedItem]) -> list[Bar]:
+ return [Bar(item.label, item.count) for item in ranking]
+
+class CategoricalColumn:
+ pass
+class CategoricalColumn:
+ #Each distinct value is stored once, rows hold the smallest integer code that fits the vocabulary
+ values: list
+ codes: np.ndarray
+
+ def __init__(self, values: list, codes: np.ndarray):
+  self.values = values
+  self.codes = codes
+
+ def code_type(size: int) -> np.dtype:
+  return np.min_scalar_type(max(0, size - 1))
+
+ def encode(values: list, lookup: dict[any, int]=None) -> CategoricalColumn:
+  lookup = dict() if lookup is None else lookup
+  codes = np.array([lookup.setdefault(value, len(lookup)) for value in values], dtype=np.int64)
+  return CategoricalColumn([intern_value(value) for value in lookup], codes.astype(CategoricalColumn.code_type(len(lookup))))
+
+ def concatenate(columns: list[CategoricalColumn]) -> CategoricalColumn:
+  #Every column's vocabulary is folded into one, so rows only pay an array gather
+  lookup: dict[any, int] = dict()
+  tables = [np.array([lookup.setdefault(value, len(lookup)) for value in column.values], dtype=np.int64) for column in columns]
+  code_type = CategoricalColumn.code_type(len(lookup))
+  return CategoricalColumn(list(lookup), np.concatenate([table.astype(code_type)[column.codes] for table, column in zip(tables, columns)]) if columns else np.zeros(0, dtype=code_type))
+
+ def matches(self, predicate) -> np.ndarray:
+  #The predicate runs once per distinct value, not once per row
+  return np.array([predicate(value) for value in self.values], dtype=bool)[self.codes]
+
+ def remap(self, function) -> CategoricalColumn:
+  lookup: dict[any, int] = dict()
+  table = np.array([lookup.setdefault(function(value), len(lookup)) for value in self.values], dtype=np.int64)
+  return CategoricalColumn([intern_value(value) for value in lookup], table.astype(CategoricalColumn.code_type(len(lookup)))[self.codes])
+
+ def take(self, rows: np.ndarray) -> CategoricalColumn:
+  return CategoricalColumn(self.values, self.codes[rows])
+
+ def counts(self, rows: np.ndarray=None) -> dict[any, int]:
+  #Ordered by first occurrence, the same key order counting row by row gives
+  codes = self.codes if rows is None else self.codes[rows]
+  unique, first, counts = np.unique(codes, return_index=True, return_counts=True)
+  order = np.argsort(first)
+  return {self.values[code]: count for code, count in zip(unique[order].tolist(), counts[order].tolist())}
+
+ def decode(self) -> list:
+  return np.array(self.values, dtype=object)[self.codes].tolist()
+
+ def split(self, separator: str = ";") -> tuple[list[str], np.ndarray, np.ndarray]:
+  #Each distinct answer is split once: item labels, then per code an offsets/items slice like a CSR row
+  lookup: dict[str, int] = dict()
+  offsets = [0]
+  items: list[int] = []
+  for value in self.values:
+   if value is not None:
+    items.extend(lookup.setdefault(item, len(lookup)) for item in value.split(separator))
+   offsets.append(len(items))
+  return [intern_value(label) for label in lookup], np.array(offsets, dtype=np.int64), np.array(items, dtype=np.int64)
+
+class EncodedSurvey:
+ pass
+class EncodedSurvey:
+ FIELDS = GithubRecord.__slots__[1:]
+ years: np.ndarray
+ columns: dict[str, CategoricalColumn]
+
+ def __init__(self, years: np.ndarray, columns: dict[str, CategoricalColumn]):
+  self.years = years
+  self.columns = columns
+
+ def __len__(self) -> int:
+  return len(self.years)
+
+ def from_rows(year: int, rows) -> EncodedSurvey:
+  #rows are query tuples in GithubRecord field order without the year, encoded a fetchmany batch at a time
+  lookups: list[dict[any, int]] = [dict() for _ in EncodedSurvey.FIELDS]
+  codes: list[array.array] = [array.array("I") for _ in EncodedSurvey.FIELDS]
+  for batch in rows:
+   for column, lookup, values in zip(codes, lookups, zip(*batch)):
+    column.extend([lookup.setdefault(value, len(lookup)) for value in values])
+  columns = {field: CategoricalColumn([intern_value(value) for value in lookup], np.frombuffer(column, dtype=np.uint32).astype(CategoricalColumn.code_type(len(lookup)))) for field, lookup, column in zip(EncodedSurvey.FIELDS, lookups, codes)}
+  return EncodedSurvey(np.full(len(codes[0]), year, dtype=np.int16), columns)
+
+ def from_records(data: list[GithubRecord]) -> EncodedSurvey:
+  years = np.fromiter((entry.year for entry in data), dtype=np.int16, count=len(data))
+  return EncodedSurvey(years, {field: CategoricalColumn.encode(list(map(operator.attrgetter(field), data))) for field in EncodedSurvey.FIELDS})
+
+ def concatenate(surveys: list[EncodedSurvey]) -> EncodedSurvey:
+  years = np.concatenate([survey.years for survey in surveys]) if surveys else np.zeros(0, dtype=np.int16)
+  return EncodedSurvey(years, {field: CategoricalColumn.concatenate([survey.columns[field] for survey in surveys]) for field in EncodedSurvey.FIELDS})
+
+ def validate(self) -> np.ndarray:
+  #SURVEY_EXCLUSIONS checked once per distinct value, the rows only see a gathered mask
+  valid = np.ones(len(self), dtype=bool)
+  for field, excluded in SURVEY_EXCLUSIONS.items():
+   valid &= self.columns[field].matches(lambda value: value not in excluded)
+  return valid
+
+ def conform(self):
+  for field, remaps in SURVEY_REMAPS.items():
+   self.columns[field] = self.columns[field].remap(lambda value: remaps.get(value, value))
+
+ def take(self, rows: np.ndarray) -> EncodedSurvey:
+  return EncodedSurvey(self.years[rows], {field: column.take(rows) for field, column in self.columns.items()})
+
+ @timing
+ def aggregate(self, specs: list[AggregateSpec]) -> AggregateResult:
+  #Counting is np.unique over small codes, multi-valued answers are split once per distinct answer
+  counts_by_year: dict[str, dict[int, dict[str, int]]] = {spec.name: dict() for spec in specs}
+  for year in np.unique(self.years).tolist():
+   rows = np.flatnonzero(self.years == year)
+   for spec in specs:
+    counts = self.columns[spec.field].counts(rows)
+    if spec.multi_value:
+     items: dict[str, int] = dict()
+     for value, count in counts.items():
+      if value is not None:
+       for item in value.split(";"):
+        items[item] = items.get(item, 0) + count
+     counts = items
+    counts_by_year[spec.name][year] = counts
+  instrumentation.add_rows(len(self))
+  return AggregateResult(counts_by_year)
+
+ @timing
+ def records(self) -> list[GithubRecord]:
+  records = [GithubRecord(*fields) for fields in zip(self.years.tolist(), *(self.columns[field].decode() for field in EncodedSurvey.FIELDS))]
+  instrumentation.add_rows(len(records))
+  return records
+
+def rank_multi_value(survey: EncodedSurvey, field: str, year: int, k: int, capacity: int) -> list[RankedItem]:
+ #Respondents' items stream through a fixed number of counters, nothing counts the whole vocabulary.
+ #Only the split table over distinct answers is held, the column's own vocabulary is already that size
+ column = survey.columns[field]
+ labels, offsets, items = column.split()
+ offsets, items = offsets.tolist(), items.tolist()
+ rows = np.flatnonzero(survey.years == year)
+ counter = SpaceSaving(capacity)
+ for start in range(0, len(rows), QueryHandler.BATCH_SIZE):
+  for code in column.codes[rows[start:start + QueryHandler.BATCH_SIZE]].tolist():
+   for item in items[offsets[code]:offsets[code + 1]]:
+    counter.add(labels[item])
+ return counter.top(k)
+
+class CooccurrenceMatrix:
+ pass
+class CooccurrenceMatrix:
+ #CSR over item ids: row r's columns are indices[indptr[r]:indptr[r + 1]], sorted, with their counts in data
+ row_labels: list[str]
+ column_labels: list[str]
+ indptr: np.ndarray
+ indices: np.ndarray
+ data: np.ndarray
+ row_totals: np.ndarray
+ column_totals: np.ndarray
+ respondents: int
+
+ def __init__(self, row_labels: list[str], column_labels: list[str], indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, row_totals: np.ndarray, column_totals: np.ndarray, respondents: int):
+  self.row_labels = row_labels
+  self.column_labels = column_labels
+  self.indptr = indptr
+  self.indices = indices
+  self.data = data
+  self.row_totals = row_totals
+  self.column_totals = column_totals
+  self.respondents = respondents
+  self.row_ids = {label: row for row, label in enumerate(row_labels)}
+  self.column_ids = {label: column for column, label in enumerate(column_labels)}
+  self.transposed = None
+
+ def from_coordinates(row_labels: list[str], column_labels: list[str], rows: np.ndarray, columns: np.ndarray, weights: np.ndarray, row_totals: np.ndarray, column_totals: np.ndarray, respondents: int) -> CooccurrenceMatrix:
+  #Duplicate cells are summed, sorting the linear keys orders rows and the columns within them at once
+  keys, inverse = np.unique(rows * len(column_labels) + columns, return_inverse=True)
+  data = np.bincount(inverse, weights=weights, minlength=len(keys)).astype(weights.dtype)
+  indptr = np.zeros(len(row_labels) + 1, dtype=np.int64)
+  np.cumsum(np.bincount(keys // max(1, len(column_labels)), minlength=len(row_labels)), out=indptr[1:])
+  return CooccurrenceMatrix(row_labels, column_labels, indptr, keys % max(1, len(column_labels)), data, row_totals, column_totals, respondents)
+
+ @timing
+ def build(survey: EncodedSurvey, row_field: str, column_field: str, year: int=None) -> CooccurrenceMatrix:
+  #One pass over the distinct (row answer, column answer) pairs, each expanded to its item pairs without a Python loop
+  selected = np.arange(len(survey)) if year is None else np.flatnonzero(survey.years == year)
+  row_column = survey.columns[row_field]
+  column_column = survey.columns[column_field]
+  row_labels, row_offsets, row_items = row_column.split()
+  column_labels, column_offsets, column_items = column_column.split()
+  row_codes = row_column.codes[selected].astype(np.int64)
+  column_codes = column_column.codes[selected].astype(np.int64)
+  pairs, pair_counts = np.unique(row_codes * len(column_column.values) + column_codes, return_counts=True)
+  pair_rows = pairs // len(column_column.values)
+  pair_columns = pairs % len(column_column.values)
+  row_lengths = np.diff(row_offsets)[pair_rows]
+  column_lengths = np.diff(column_offsets)[pair_columns]
+  sizes = row_lengths * column_lengths
+  pair = np.repeat(np.arange(len(pairs)), sizes)
+  within = np.arange(len(pair)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+  rows = row_items[row_offsets[pair_rows[pair]] + within // column_lengths[pair]]
+  columns = column_items[column_offsets[pair_columns[pair]] + within % column_lengths[pair]]
+  #Respondents naming each item, whatever they answered on the other side
+  row_totals = np.bincount(row_items, weights=np.repeat(np.bincount(row_codes, minlength=len(row_column.values)), np.diff(row_offsets)), minlength=len(row_labels)).astype(np.int64)
+  column_totals = np.bincount(column_items, weights=np.repeat(np.bincount(column_codes, minlength=len(column_column.values)), np.diff(column_offsets)), minlength=len(column_labels)).astype(np.int64)
+  instrumentation.add_rows(len(selected))
+  return CooccurrenceMatrix.from_coordinates(row_labels, column_labels, rows, columns, pair_counts[pair], row_totals, column_totals, len(selected))
+
+ def nnz(self) -> int:
+  return len(self.indices)
+
+ def get(self, row_label: str, column_label: str) -> float:
+  if row_label not in self.row_ids or column_label not in self.column_ids:
+   return 0
+  row = self.row_ids[row_label]
+  start, end = self.indptr[row], self.indptr[row + 1]
+  position = start + np.searchsorted(self.indices[start:end], self.column_ids[column_label])
+  return self.data[position].item() if position < end and self.indices[position] == self.column_ids[column_label] else 0
+
+ def row(self, label: str) -> dict[str, float]:
+  if label not in self.row_ids:
+   return dict()
+  row = self.row_ids[label]
+  start, end = self.indptr[row], self.indptr[row + 1]
+  return {self.column_labels[column]: value for column, value in zip(self.indices[start:end].tolist(), self.data[start:end].tolist())}
+
+ def transpose(self) -> CooccurrenceMatrix:
+  #Built once on first use, column lookups are then row lookups on the transpose
+  if self.transposed is None:
+   rows = np.repeat(np.arange(len(self.row_labels)), np.diff(self.indptr))
+   self.transposed = CooccurrenceMatrix.from_coordinates(self.column_labels, self.row_labels, self.indices, rows, self.data, self.column_totals, self.row_totals, self.respondents)
+  return self.transposed
+
+ def column(self, label: str) -> dict[str, float]:
+  return self.transpose().row(label)
+
+ def normalize(self, method: str = "row") -> CooccurrenceMatrix:
+  #row: share of the row item's respondents, column: share of the column item's, lift: observed over independent co-occurrence
+  rows = np.repeat(np.arange(len(self.row_labels)), np.diff(self.indptr))
+  match method:
+   case "row":
+    data = self.data / self.row_totals[rows]
+   case "column":
+    data = self.data / self.column_totals[self.indices]
+   case "lift":
+    data = self.data * self.respondents / (self.row_totals[rows] * self.column_totals[self.indices])
+   case _:
+    raise ValueError(f"Unknown normalization {method}")
+  return CooccurrenceMatrix(self.row_labels, self.column_labels, self.indptr, self.indices, data, self.row_totals, self.column_totals, self.respondents)
+
+ def top_k(self, label: str, k: int) -> list[RankedItem]:
+  return top_k(self.row(label), k)
+
+SURVEY_QUERY = f"SELECT {', '.join(SURVEY_COLUMNS.values())} FROM data_{{}}"
+
+def discover_years(query_handler: QueryHandler) -> list[int]:
+ #Every data_<year> table is a survey year, a new one is picked up without code changes
+ tables = query_handler.execute_atomic_query("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'data_[0-9]*'")
+ return sorted(int(name[len("data_"):]) for name, in tables if name[len("data_"):].isdigit())
+
+def table_digest(query_handler: QueryHandler, year: int):
+ #SHA-256 over the table's schema and then every projected row, see digest_rows
+ schema = query_handler.execute_atomic_query("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", parameters=(f"data_{year}",))[0][0]
+ return hashlib.sha256(schema.encode("utf-8"))
+
+def digest_rows(batches, digest):
+ #Passes the batches through while hashing them, so the load that reads a table fingerprints it at the same time.
+ #marshal serialises a whole fetchmany batch in C, the hashing costs little more than fetching the rows. Its bytes
+ #can differ between Python versions, which only makes the next run re-analyse the table
+ for rows in batches:
+  digest.update(marshal.dumps(rows))
+  yield rows
+
+def hash_table(query_handler: QueryHandler, year: int) -> str:
+ digest = table_digest(query_handler, year)
+ for _ in digest_rows(query_handler.iterate_batches(SURVEY_QUERY.format(year)), digest):
+  pass
+ return digest.hexdigest()
+
+@timing
+def analyse_partition(file_path: str, year: int, specs: list[AggregateSpec], directory: str=None) -> tuple[EncodedSurvey, AggregateResult]:
+ #Each worker gets its own connection, sqlite3 connections can't be shared across threads
+ query_handler = QueryHandler(file_path, read_only=True)
+ query = SURVEY_QUERY.format(year)
+ fingerprint = SurveyExtract.fingerprint(query, specs)
+ partition_directory = None if directory is None else os.path.join(directory, f"data_{year}")
+ if partition_directory is not None:
+  cached = SurveyExtract.load(partition_directory, file_path, fingerprint, lambda: hash_table(query_handler, year))
+  if cached is not None:
+   return cached
+ digest = table_digest(query_handler, year)
+ loaded = EncodedSurvey.from_rows(year, digest_rows(query_handler.iterate_batches(query), digest))
+ survey = loaded.take(loaded.validate())
+ survey.conform()
+ aggregates = survey.aggregate(specs)
+ if partition_directory is not None:
+  SurveyExtract.write(partition_directory, survey, aggregates, {"file": SurveyExtract.source_key(file_path), "table": digest.hexdigest()}, fingerprint)
+ return survey, aggregates
+
+@timing
+def load_partitions(file_path: str, years: list[int], specs: list[AggregateSpec], workers: int=None, directory: str=None, processes: bool=False) -> tuple[EncodedSurvey, AggregateResult]:
+ #One table per worker. Threads only overlap sqlite's reads, encoding and counting hold the GIL,
+ #so processes are what brings the load down to about the largest table when there are cores for it
+ executor_type = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+ partitions: dict[int, tuple[EncodedSurvey, AggregateResult]] = dict()
+ with executor_type(max_workers=workers or max(1, len(years))) as executor:
+  futures = {executor.submit(analyse_partition, file_path, year, specs, directory): year for year in years}
+  for future in concurrent.futures.as_completed(futures):
+   partitions[futures[future]] = future.result()
+ #Concatenated in year order whatever order they finished in, the aggregates rely on year-ordered data
+ survey = EncodedSurvey.concatenate([partitions[year][0] for year in years])
+ instrumentation.add_rows(len(survey))
+ return survey, AggregateResult.merge([partitions[year][1] for year in years])
+
+class SurveyExtract:
+ #One directory per survey table: the sanitised rows as .npy dictionary code columns, memory-mapped back on later runs, and that year's aggregates
+ def fingerprint(query: str, specs: list[AggregateSpec]) -> str:
+  #The extract holds sanitised rows and their counts, so the rules and specs are part of what it was built from
+  return hashlib.sha256(json.dumps([query, SURVEY_EXCLUSIONS, SURVEY_REMAPS, [[spec.name, spec.field, spec.multi_value] for spec in specs]]).encode("utf-8")).hexdigest()
+
+ def source_key(source_path: str) -> dict:
+  status = os.stat(source_path)
+  return {"size": status.st_size, "mtime_ns": status.st_mtime_ns}
+
+ def write_manifest(directory: str, manifest: dict):
+  manifest_path = os.path.join(directory, "manifest.json")
+  with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_handler:
+   json.dump(manifest, manifest_handler)
+  os.replace(manifest_path + ".tmp", manifest_path)
+
+ @timing
+ def write(directory: str, survey: EncodedSurvey, aggregates: AggregateResult, source: dict, fingerprint: str):
+  os.makedirs(directory, exist_ok=True)
+  manifest_path = os.path.join(directory, "manifest.json")
+  #The manifest goes last, a half written extract has none and is never opened
+  if os.path.exists(manifest_path):
+   os.remove(manifest_path)
+  np.save(os.path.join(directory, "year.npy"), survey.years)
+  for field, column in survey.columns.items():
+   np.save(os.path.join(directory, f"{field}.npy"), column.codes)
+  SurveyExtract.write_manifest(directory, {
+   "fingerprint": fingerprint,
+   "source": source,
+   "rows": len(survey),
+   "vocabularies": {field: column.values for field, column in survey.columns.items()},
+   #Pairs rather than objects, keys can be None and their order is the ranking tie order
+   "aggregates": {name: [[year, list(counts.items())] for year, counts in counts_by_year.items()] for name, counts_by_year in aggregates.counts_by_year.items()}
+  })
+  instrumentation.add_rows(len(survey))
+
+ @timing
+ def load(directory: str, source_path: str, fingerprint: str, table_hash) -> tuple[EncodedSurvey, AggregateResult]:
+  manifest_path = os.path.join(directory, "manifest.json")
+  if not os.path.exists(manifest_path):
+   return None
+  with open(manifest_path, "r", encoding="utf-8") as manifest_handler:
+   manifest = json.load(manifest_handler)
+  if manifest["fingerprint"] != fingerprint:
+   return None
+  source = manifest["source"]
+  if SurveyExtract.source_key(source_path) != source["file"]:
+   #Adding a year rewrites the file but leaves the other tables alone, only a digest of this table's own rows can tell
+   if table_hash() != source["table"]:
+    return None
+   source["file"] = SurveyExtract.source_key(source_path)
+   SurveyExtract.write_manifest(directory, manifest)
+  years = np.load(os.path.join(directory, "year.npy"), mmap_mode="r")
+  columns = {field: CategoricalColumn([intern_value(value) for value in values], np.load(os.path.join(directory, f"{field}.npy"), mmap_mode="r")) for field, values in manifest["vocabularies"].items()}
+  aggregates = AggregateResult({name: {year: {intern_value(key): count for key, count in counts} for year, counts in counts_by_year} for name, counts_by_year in manifest["aggregates"].items()})
+  instrumentation.add_rows(manifest["rows"])
+  return EncodedSurvey(years, columns), aggregates
+
+class SurveyIndex:
+ pass
+class SurveyIndex:
+ #Row id bitmaps per field value, held as Python ints so AND/OR/popcount run in C, zlib compressed on disk
+ FIELDS = ("year", "country", "education_level", "main_branch", "age", "languages_worked_with", "languages_interested_in", "dbms_worked_with", "dbms_interested_in")
+ MULTI_VALUE_FIELDS = ("languages_worked_with", "languages_interested_in", "dbms_worked_with", "dbms_interested_in")
+ row_count: int
+ bitmaps: dict[str, dict[any, int]]
+
+ def __init__(self, row_count: int, bitmaps: dict[str, dict[any, int]]):
+  self.row_count = row_count
+  self.bitmaps = bitmaps
+
+ def bitmaps_from_pairs(labels: list, rows: np.ndarray, items: np.ndarray, row_count: int) -> dict[any, int]:
+  #One bitmap per item id over its (row, item) pairs, which come in row order, keyed in order of first appearance
+  order = np.argsort(items, kind="stable")
+  rows, items = rows[order], items[order]
+  starts = np.flatnonzero(np.diff(items, prepend=-1))
+  ends = np.append(starts[1:], len(items))
+  bitmaps = dict()
+  for start, end in sorted(zip(starts.tolist(), ends.tolist()), key=lambda bounds: order[bounds[0]]):
+   bits = np.zeros(row_count // 8 + 1, dtype=np.uint8)
+   group = rows[start:end]
+   np.bitwise_or.at(bits, group >> 3, np.left_shift(1, group & 7).astype(np.uint8))
+   bitmaps[labels[items[start]]] = int.from_bytes(bits.tobytes(), "little")
+  return bitmaps
+
+ @timing
+ def build(survey: EncodedSurvey) -> SurveyIndex:
+  #Straight from the code columns, multi-value answers go through the split table once per distinct answer
+  row_count = len(survey)
+  years, year_codes = np.unique(survey.years, return_inverse=True)
+  bitmaps = {"year": SurveyIndex.bitmaps_from_pairs(years.tolist(), np.arange(row_count), year_codes.reshape(-1), row_count)}
+  for field in SurveyIndex.FIELDS[1:]:
+   column = survey.columns[field]
+   codes = column.codes.astype(np.int64)
+   if field in SurveyIndex.MULTI_VALUE_FIELDS:
+    labels, offsets, items = column.split()
+    sizes = np.diff(offsets)[codes]
+    rows = np.repeat(np.arange(row_count), sizes)
+    within = np.arange(len(rows)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    bitmaps[field] = SurveyIndex.bitmaps_from_pairs(labels, rows, items[offsets[codes][rows] + within], row_count)
+   else:
+    bitmaps[field] = SurveyIndex.bitmaps_from_pairs(column.values, np.arange(row_count), codes, row_count)
+  instrumentation.add_rows(row_count)
+  return SurveyIndex(row_count, bitmaps)
+
+ def save(self, file_path: str, source_path: str):
+  #Plain JSON, values next to base64 zlib bitmaps, with the database it was built from so a stale index is rebuilt
+  size = self.row_count // 8 + 1
+  index = {
+   "fingerprint": SurveyExtract.fingerprint(SURVEY_QUERY, []),
+   "source": SurveyExtract.source_key(source_path),
+   "row_count": self.row_count,
+   "bitmaps": {field: [[value, base64.b64encode(zlib.compress(bitmap.to_bytes(size, "little"))).decode("ascii")] for value, bitmap in bitmaps.items()] for field, bitmaps in self.bitmaps.items()}
+  }
+  with open(file_path + ".tmp", "w", encoding="utf-8") as file:
+   json.dump(index, file)
+  os.replace(file_path + ".tmp", file_path)
+
+ def load(file_path: str, source_path: str) -> SurveyIndex:
+  #None when the index is missing or was built from another database or other sanitising rules
+  if not os.path.exists(file_path) or not os.path.exists(source_path):
+   return None
+  with open(file_path, "r", encoding="utf-8") as file:
+   index = json.load(file)
+  if index.get("fingerprint") != SurveyExtract.fingerprint(SURVEY_QUERY, []) or index.get("source") != SurveyExtract.source_key(source_path):
+   return None
+  return SurveyIndex(index["row_count"], {field: {value: int.from_bytes(zlib.decompress(base64.b64decode(bitmap)), "little") for value, bitmap in bitmaps} for field, bitmaps in index["bitmaps"].items()})
+
+ def everything(self) -> int:
+  return (1 << self.row_count) - 1
+
+ def bitmap(self, field: str, *values) -> int:
+  #Several values of one field are OR-ed together
+  bitmap = 0
+  for value in values:
+   bitmap |= self.bitmaps[field].get(value, 0)
+  return bitmap
+
+ def where(self, **criteria) -> int:
+  #Different fields are AND-ed, a list or tuple of values ORs within a field
+  bitmap = self.everything()
+  for field, values in criteria.items():
+   bitmap &= self.bitmap(field, *(values if isinstance(values, (list, tuple)) else (values,)))
+  return bitmap
+
+ def count(self, **criteria) -> int:
+  return self.where(**criteria).bit_count()
+
+ def counts(self, field: str, within: int=None) -> dict[any, int]:
+  if within is None:
+   return {value: bitmap.bit_count() for value, bitmap in self.bitmaps[field].items()}
+  return {value: (bitmap & within).bit_count() for value, bitmap in self.bitmaps[field].items()}
+
+ def rows(self, bitmap: int) -> list[int]:
+  rows = []
+  for offset, byte in enumerate(bitmap.to_bytes(self.row_count // 8 + 1, "little")):
+   while byte:
+    low = byte & -byte
+    rows.append((offset << 3) + low.bit_length() - 1)
+    byte ^= low
+  return rows
+
+def parse_index_query(terms: list[str]) -> dict[str, list]:
+ criteria: dict[str, list] = dict()
+ for term in terms:
+  field, _, value = term.partition("=")
+  criteria.setdefault(field, []).append(int(value) if field == "year" else value)
+ return criteria
+
+MULTI_VALUE_COLUMNS = {field: SURVEY_COLUMNS[field] for field in ("languages_worked_with", "languages_interested_in", "dbms_worked_with", "dbms_interested_in")}
+
+#Splits the ;-separated answers inside SQLite by turning each one into a JSON array for json_each,
+#ordered by first occurrence so ties rank the same as the Python path
+MULTI_VALUE_QUERY = "SELECT value, SUM(count) FROM ({tables}) GROUP BY value ORDER BY MIN(ordinal)"
+#json_quote escapes quotes, backslashes and control characters but leaves ';' alone, so splitting inside the quoted string stays valid JSON
+MULTI_VALUE_TABLE_QUERY = """
+SELECT answer.value AS value, COUNT(*) AS count, MIN(({year} * 1000000000 + data_{year}.rowid) * 1000 + answer.key) AS ordinal
+FROM data_{year}, json_each('[' || replace(json_quote({column}), ';', '","') || ']') AS answer
+WHERE {column} IS NOT NULL AND {validity}
+GROUP BY answer.value
 """
 
-all_worked_with_programming_languages_2021 = [(k, v) for k, v in get_worked_with_programming_languages(valid_subset, 2021).items()]
-all_interested_in_programming_languages_2021 = [(k, v) for k, v in get_interested_in_programming_languages(valid_subset, 2021).items()]
-all_worked_with_dbms_2021 = [(k, v) for k, v in get_worked_with_dbms(valid_subset, 2021).items()]
-all_interested_in_dbms_2021 = [(k, v) for k, v in get_interested_in_dbms(valid_subset, 2021).items()]
-all_worked_with_programming_languages_2022 = [(k, v) for k, v in get_worked_with_programming_languages(valid_subset, 2022).items()]
-all_interested_in_programming_languages_2022 = [(k, v) for k, v in get_interested_in_programming_languages(valid_subset, 2022).items()]
-all_worked_with_dbms_2022 = [(k, v) for k, v in get_worked_with_dbms(valid_subset, 2022).items()]
-all_interested_in_dbms_2022 = [(k, v) for k, v in get_interested_in_dbms(valid_subset, 2022).items()]
-all_worked_with_programming_languages_2023 = [(k, v) for k, v in get_worked_with_programming_languages(valid_subset, 2023).items()]
-all_interested_in_programming_languages_2023 = [(k, v) for k, v in get_interested_in_programming_languages(valid_subset, 2023).items()]
-all_worked_with_dbms_2023 = [(k, v) for k, v in get_worked_with_dbms(valid_subset, 2023).items()]
-all_interested_in_dbms_2023 = [(k, v) for k, v in get_interested_in_dbms(valid_subset, 2023).items()]
-
-popular_worked_with_programming_languages_2021 = sorted(all_worked_with_programming_languages_2021, key=lambda x: x[1], reverse=True)[:5]
-popular_interested_in_programming_languages_2021 = sorted(all_interested_in_programming_languages_2021, key=lambda x: x[1], reverse=True)[:5]
-popular_worked_with_dbms_2021 = sorted(all_worked_with_dbms_2021, key=lambda x: x[1], reverse=True)[:5]
-popular_interested_in_dbms_2021 = sorted(all_interested_in_dbms_2021, key=lambda x: x[1], reverse=True)[:5]
-popular_worked_with_programming_languages_2022 = sorted(all_worked_with_programming_languages_2022, key=lambda x: x[1], reverse=True)[:5]
-popular_interested_in_programming_languages_2022 = sorted(all_interested_in_programming_languages_2022, key=lambda x: x[1], reverse=True)[:5]
-popular_worked_with_dbms_2022 = sorted(all_worked_with_dbms_2022, key=lambda x: x[1], reverse=True)[:5]
-popular_interested_in_dbms_2022 = sorted(all_interested_in_dbms_2022, key=lambda x: x[1], reverse=True)[:5]
-popular_worked_with_programming_languages_2023 = sorted(all_worked_with_programming_languages_2023, key=lambda x: x[1], reverse=True)[:5]
-popular_interested_in_programming_languages_2023 = sorted(all_interested_in_programming_languages_2023, key=lambda x: x[1], reverse=True)[:5]
-popular_worked_with_dbms_2023 = sorted(all_worked_with_dbms_2023, key=lambda x: x[1], reverse=True)[:5]
-popular_interested_in_dbms_2023 = sorted(all_interested_in_dbms_2023, key=lambda x: x[1], reverse=True)[:5]
-
-popular_worked_with_programming_languages = (
- popular_worked_with_programming_languages_2021, 
- popular_worked_with_programming_languages_2022, 
- popular_worked_with_programming_languages_2023
-)
-popular_interested_in_programming_languages = (
- popular_interested_in_programming_languages_2021, 
- popular_interested_in_programming_languages_2022, 
- popular_interested_in_programming_languages_2023
-)
-popular_worked_with_dbms = (
- popular_worked_with_dbms_2021, 
- popular_worked_with_dbms_2022, 
- popular_worked_with_dbms_2023
-)
-popular_interested_in_dbms = (
- popular_interested_in_dbms_2021, 
- popular_interested_in_dbms_2022, 
- popular_interested_in_dbms_2023
-)
-
-final_data = valid_subset
-
-unique_countries = get_countries(final_data)
-education_level_by_years = get_education_level_by_years(final_data) #1.1.5 (3 marks)
-unique_main_branches2021 = get_main_branches(final_data, 2021)
-unique_main_branches2022 = get_main_branches(final_data, 2022)
-unique_main_branches2023 = get_main_branches(final_data, 2023)
-main_branch_representation_by_years = get_main_branch_representation_by_years(final_data)
-
-unique_main_branches = list(
- set(
-  list(unique_main_branches2021.keys()) + 
-  list(unique_main_branches2022.keys()) + 
-  list(unique_main_branches2023.keys())
- )
-)
-create_line_graph(
- [
-  Line(
-   unique_main_branch,
-   [
-    Point(
-     index, 
-     main_branch_representation_by_year[unique_main_branch] if unique_main_branch in main_branch_representation_by_year else 0)
-    for index, main_branch_representation_by_year in enumerate(main_branch_representation_by_years)
-   ]
+@timing
+def count_multi_value_sql(query_handler: QueryHandler, field: str, year: int=None, years: list[int]=None) -> dict[str, int]:
+ column = MULTI_VALUE_COLUMNS[field]
+ years = discover_years(query_handler) if years is None else years
+ tables = " UNION ALL ".join(MULTI_VALUE_TABLE_QUERY.format(year=table_year, column=column, validity=sql_validity(SURVEY_EXCLUSIONS)) for table_year in (years if year is None else [year]))
+ return dict(query_handler.execute_atomic_query(MULTI_VALUE_QUERY.format(tables=tables)))
+
+@timing
+def get_main_branch_representation_by_years(data: list[GithubRecord], years: list[int]=None):
+ years = sorted({entry.year for entry in data}) if years is None else years
+ return [{k: v for k, v in sorted(get_main_branches(data, year).items(), key=lambda item: item[1])} for year in years]
+
+if __name__ == "__main__":
+ parser = argparse.ArgumentParser()
+ parser.add_argument("--sql-aggregation", action="store_true")
+ parser.add_argument("--load-workers", type=int)
+ parser.add_argument("--load-processes", action="store_true")
+ parser.add_argument("--ranking-capacity", type=int)
+ parser.add_argument("--extract")
+ parser.add_argument("--cooccurrence", nargs=3, metavar=("ROW_FIELD", "COLUMN_FIELD", "ITEM"))
+ parser.add_argument("--normalization", choices=("row", "column", "lift"), default="row")
+ parser.add_argument("--index")
+ parser.add_argument("--query", nargs="+", default=[])
+ parser.add_argument("--render-workers", type=int, default=1)
+ parser.add_argument("--render-cache", default="graphs/.render_cache.json")
+ parser.add_argument("--force-render", action="store_true")
+ parser.add_argument("--profile", action="store_true")
+ parser.add_argument("--profile-report")
+ parser.add_argument("--profile-memory", action="store_true")
+ arguments = parser.parse_args()
+
+ if arguments.profile or arguments.profile_memory or arguments.profile_report is not None:
+  instrumentation.enable(arguments.profile_report, arguments.profile_memory)
+
+ #A saved index answers cross-filtered counts without touching the database, as long as the database hasn't changed
+ survey_index = SurveyIndex.load(arguments.index, "data/Github.db") if arguments.index is not None and arguments.query else None
+ if survey_index is not None:
+  print(survey_index.count(**parse_index_query(arguments.query)))
+  sys.exit(0)
+
+ if not os.path.exists("data/Github.db"):
+  with zipfile.ZipFile("data/data.zip") as file:
+   file.extractall("data")
+
+ query_handler = QueryHandler("data/Github.db", read_only=True)
+ #data = query_handler.execute_atomic_query("SELECT name, sql FROM sqlite_master WHERE type='table'")
+
+ #Load (1.1.1), sanitise (1.1.3) and count each year's table in its own worker, reusing unchanged years from --extract
+ years = discover_years(query_handler)
+ survey_data, survey = load_partitions("data/Github.db", years, SURVEY_AGGREGATES, arguments.load_workers, arguments.extract, arguments.load_processes)
+
+ if arguments.cooccurrence is not None:
+  row_field, column_field, item = arguments.cooccurrence
+  for year in years:
+   matrix = CooccurrenceMatrix.build(survey_data, row_field, column_field, year).normalize(arguments.normalization)
+   print(year, ", ".join(f"{ranked.label}: {ranked.count:.3f}" for ranked in matrix.top_k(item, 5)))
+
+ if arguments.index is not None:
+  survey_index = SurveyIndex.build(survey_data)
+  survey_index.save(arguments.index, "data/Github.db")
+  if arguments.query:
+   print(survey_index.count(**parse_index_query(arguments.query)))
+
+ """
+ 2.1.1.1 (5 Marks)
+ """
+ main_branch_representation_by_years = survey.representation_by_years("main_branches", years)
+ a = list(
+  [year_data[key] for year_data in main_branch_representation_by_years]
+
+  for key in set(
+   key 
+   for keys in (
+    year_data.keys() 
+    for year_data in 
+     main_branch_representation_by_years
+   )
+   for key in keys
   )
-  for unique_main_branch in unique_main_branches
- ],
- "graphs/2.1.1.1.png"
-)
-
-unique_education_levels = list(
- set(
-  list(education_level_by_years[0].keys()) + 
-  list(education_level_by_years[1].keys()) + 
-  list(education_level_by_years[2].keys())
  )
-)
-create_line_graph(
- [
-  Line(
-   unique_education_level,
-   [
-    Point(
-     index, 
-     education_level_by_year[unique_education_level] if unique_education_level in education_level_by_year else 0)
-    for index, education_level_by_year in enumerate(education_level_by_years)
-   ]
-  )
-  for unique_education_level in unique_education_levels
- ],
- "graphs/2.1.1.2.png"
-)
-
-create_bar_graph(
- (
-  "WW Programming Language", 
-  "# Users"
- ), 
- [
-  Bar(popular_worked_with_programming_language_2023[0], popular_worked_with_programming_language_2023[1]) 
-  for popular_worked_with_programming_language_2023 in popular_worked_with_programming_languages_2023
- ],
- "graphs/2.1.2.1.1.png"
-)
-
-create_bar_graph(
- (
-  "II Programming Language", 
-  "# Users"
- ), 
- [
-  Bar(popular_interested_in_programming_language_2023[0], popular_interested_in_programming_language_2023[1]) 
-  for popular_interested_in_programming_language_2023 in popular_interested_in_programming_languages_2023
- ],
- "graphs/2.1.2.1.2.png"
-)
-
-create_bar_graph(
- (
-  "WW DBMS", 
-  "# Users"
- ), 
- [
-  Bar(popular_worked_with_dbms_2023[0], popular_worked_with_dbms_2023[1]) 
-  for popular_worked_with_dbms_2023 in popular_worked_with_dbms_2023
- ],
- "graphs/2.1.2.1.3.png"
-)
-
-create_bar_graph(
- (
-  "II DBMS", 
-  "# Users"
- ), 
- [
-  Bar(popular_interested_in_dbms_2023[0], popular_interested_in_dbms_2023[1]) 
-  for popular_interested_in_dbms_2023 in popular_interested_in_dbms_2023
- ],
- "graphs/2.1.2.1.4.png"
-)
\ No newline at end of file
+ #print(a)
+ # create_graph()
+
+
+ """
+ 2.1.2.1
+ """
+ if arguments.sql_aggregation:
+  count_multi_value = lambda field, year: count_multi_value_sql(query_handler, field, year)
+ else:
+  count_multi_value = lambda field, year: survey.counts(field, year)
+
+ if arguments.ranking_capacity is None:
+  rank = lambda field, year: top_k(count_multi_value(field, year), 5)
+ else:
+  rank = lambda field, year: rank_multi_value(survey_data, field, year, 5, arguments.ranking_capacity)
+ popular = {field: [rank(field, year) for year in years] for field in MULTI_VALUE_COLUMNS}
+
+ popular_worked_with_programming_languages = popular["languages_worked_with"]
+ popular_interested_in_programming_languages = popular["languages_interested_in"]
+ popular_worked_with_dbms = popular["dbms_worked_with"]
+ popular_interested_in_dbms = popular["dbms_interested_in"]
+
+ final_data = survey_data
+
+ unique_countries = survey.counts("countries")
+ education_level_by_years = survey.counts_by_years("education_levels", years) #1.1.5 (3 marks)
+ main_branch_representation_by_years = survey.representation_by_years("main_branches", years)
+
+ #Sorted so the same counts always give the same chart, and the same content hash
+ unique_main_branches = sorted(set(key for counts in survey.counts_by_years("main_branches", years) for key in counts), key=str)
+ charts: list[rendering.Chart] = []
+ charts.append(rendering.line_chart(
+  [
+   Line(
+    unique_main_branch,
+    [
+     Point(
+      index, 
+      main_branch_representation_by_year[unique_main_branch] if unique_main_branch in main_branch_representation_by_year else 0)
+     for index, main_branch_representation_by_year in enumerate(main_branch_representation_by_years)
+    ]
+   )
+   for unique_main_branch in unique_main_branches
+  ],
+  "graphs/2.1.1.1.png"
+ ))
+
+ unique_education_levels = sorted(set(key for counts in education_level_by_years for key in counts), key=str)
+ charts.append(rendering.line_chart(
+  [
+   Line(
+    unique_education_level,
+    [
+     Point(
+      index, 
+      education_level_by_year[unique_education_level] if unique_education_level in education_level_by_year else 0)
+     for index, education_level_by_year in enumerate(education_level_by_years)
+    ]
+   )
+   for unique_education_level in unique_education_levels
+  ],
+  "graphs/2.1.1.2.png"
+ ))
+
+ for field, label, file_path in (
+  ("languages_worked_with", "WW Programming Language", "graphs/2.1.2.1.1.png"),
+  ("languages_interested_in", "II Programming Language", "graphs/2.1.2.1.2.png"),
+  ("dbms_worked_with", "WW DBMS", "graphs/2.1.2.1.3.png"),
+  ("dbms_interested_in", "II DBMS", "graphs/2.1.2.1.4.png")
+ ):
+  #Charts the latest survey year
+  charts.append(rendering.bar_chart((label, "# Users"), ranking_bars(popular[field][-1]), file_path))
+
+ rendering.render_charts(charts, arguments.render_workers, arguments.render_cache, arguments.force_render)
@@ -1,10 +1,24 @@
+import io
+import os
+import re
 import csv
+import sys
 import json
-import time
+import mmap
+import array
+import sqlite3
+import hashlib
+import urllib.parse
+import argparse
 import uuid
 import datetime
 import functools
-import matplotlib.pyplot as plt
+import collections
+import concurrent.futures
+import numpy as np
+import instrumentation
+import rendering
+from instrumentation import timing
 
 class Point:
  x: float
@@ -22,15 +36,6 @@ class Line:
   self.label = label
   self.points = points
 
-def create_line_graph(lines: list[Line], file_path: str):
-    plt.clf()
-    for line in lines:
-        xs = [point.x for point in line.points]
-        ys = [point.y for point in line.points]
-        plt.plot(xs, ys, label = line.label)
-    plt.legend(bbox_to_anchor=(0.5, -0.1), loc='upper center')
-    plt.savefig(file_path, bbox_inches="tight")
-
 
 class SentimentKeywordLookup:
     POSITIVE = [
@@ -293,26 +298,154 @@ class Sentiment:
     NEGATIVE = 1
     NEUTRAL = 2
 
-def timing(function):
-    @functools.wraps(function)
-    def wrap(*args, **kw):
-        start_time = time.time()
-        result = function(*args, **kw)
-        end_time = time.time()
-        print(f"Function: {function.__name__} Took {end_time - start_time}s")
-        return result
-    return wrap
-
-class UUIDEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, uuid.UUID):
-            return f"{obj}"
-        return json.JSONEncoder.default(self, obj)
+class SentimentMatcher:
+    #Aho-Corasick automaton over both keyword lists, so a review is scanned once instead of once per keyword
+    transitions: list[dict[str, int]]
+    outputs: list[tuple[int, ...]]
+    lengths: list[int]
+    weights: list[tuple[int, int]]
+
+    def __init__(self, positive: list[str], negative: list[str]):
+        #Duplicate keywords are folded into a weight, content.count() would have counted them once per list entry
+        pattern_ids: dict[str, int] = dict()
+        self.lengths = []
+        self.weights = []
+        for keywords, polarity in ((positive, 0), (negative, 1)):
+            for keyword in keywords:
+                if keyword not in pattern_ids:
+                    pattern_ids[keyword] = len(self.lengths)
+                    self.lengths.append(len(keyword))
+                    self.weights.append([0, 0])
+                self.weights[pattern_ids[keyword]][polarity] += 1
+        self.weights = [tuple(weight) for weight in self.weights]
+
+        goto: list[dict[str, int]] = [dict()]
+        outputs: list[list[int]] = [[]]
+        for keyword, pattern_id in pattern_ids.items():
+            state = 0
+            for character in keyword:
+                if character not in goto[state]:
+                    goto.append(dict())
+                    outputs.append([])
+                    goto[state][character] = len(goto) - 1
+                state = goto[state][character]
+            outputs[state].append(pattern_id)
+
+        #Breadth first so every failure link points at an already completed state, then fold the links into a full transition table
+        alphabet = set(character for keyword in pattern_ids for character in keyword)
+        failures = [0] * len(goto)
+        self.transitions = [dict() for _ in goto]
+        self.transitions[0] = {character: goto[0].get(character, 0) for character in alphabet}
+        queue = list(goto[0].values())
+        for state in queue:
+            for character, next_state in goto[state].items():
+                queue.append(next_state)
+            for character in alphabet:
+                if character in goto[state]:
+                    next_state = goto[state][character]
+                    failures[next_state] = self.transitions[failures[state]][character]
+                    outputs[next_state].extend(outputs[failures[next_state]])
+                    self.transitions[state][character] = next_state
+                else:
+                    self.transitions[state][character] = self.transitions[failures[state]][character]
+        self.outputs = [tuple(output) for output in outputs]
+
+    def count(self, content: str) -> tuple[int, int]:
+        transitions = self.transitions
+        outputs = self.outputs
+        lengths = self.lengths
+        weights = self.weights
+        #str.count() only counts non-overlapping occurrences, so track where each keyword's last counted hit ended
+        last_ends: dict[int, int] = dict()
+        positive = 0
+        negative = 0
+        state = 0
+        for index, character in enumerate(content):
+            state = transitions[state].get(character, 0)
+            if outputs[state]:
+                for pattern_id in outputs[state]:
+                    if index - lengths[pattern_id] >= last_ends.get(pattern_id, -1):
+                        last_ends[pattern_id] = index
+                        positive += weights[pattern_id][0]
+                        negative += weights[pattern_id][1]
+        return positive, negative
+
+class TokenSentimentEngine:
+    #Matches whole words only, so "op" no longer hits inside "open" nor "like" inside "unlikely"
+    TOKEN_PATTERN = re.compile(r"[\w']+(?:/\w+)?")
+    positive_words: frozenset[str]
+    negative_words: frozenset[str]
+    phrases: dict[str, list[tuple[tuple[str, ...], int]]]
+
+    def __init__(self, positive: list[str], negative: list[str]):
+        #Sets drop the duplicate keywords, so "waste" or "goood" only count once per occurrence
+        positive_words = set()
+        negative_words = set()
+        phrases: dict[tuple[str, ...], int] = dict()
+        for keywords, words, polarity in ((positive, positive_words, Sentiment.POSITIVE), (negative, negative_words, Sentiment.NEGATIVE)):
+            for keyword in keywords:
+                tokens = tuple(TokenSentimentEngine.TOKEN_PATTERN.findall(keyword.lower()))
+                if len(tokens) == 1:
+                    words.add(tokens[0])
+                elif len(tokens) > 1:
+                    phrases[tokens] = polarity
+        self.positive_words = frozenset(positive_words)
+        self.negative_words = frozenset(negative_words)
+        #Phrases are indexed by their first token, longest first, so a review position only checks the phrases that could start there
+        self.phrases = dict()
+        for tokens, polarity in sorted(phrases.items(), key=lambda item: len(item[0]), reverse=True):
+            self.phrases.setdefault(tokens[0], []).append((tokens, polarity))
+
+    def count(self, content: str) -> tuple[int, int]:
+        tokens = TokenSentimentEngine.TOKEN_PATTERN.findall(content)
+        positive_words = self.positive_words
+        negative_words = self.negative_words
+        phrases = self.phrases
+        positive = 0
+        negative = 0
+        for index, token in enumerate(tokens):
+            if token in positive_words:
+                positive += 1
+            elif token in negative_words:
+                negative += 1
+            if token in phrases:
+                for phrase, polarity in phrases[token]:
+                    if tuple(tokens[index:index + len(phrase)]) == phrase:
+                        if polarity == Sentiment.POSITIVE:
+                            positive += 1
+                        else:
+                            negative += 1
+                        break
+        return positive, negative
+
+sentiment_matcher = SentimentMatcher(SentimentKeywordLookup.POSITIVE, SentimentKeywordLookup.NEGATIVE)
+token_sentiment_engine = TokenSentimentEngine(SentimentKeywordLookup.POSITIVE, SentimentKeywordLookup.NEGATIVE)
+sentiment_engines = {
+    "substring": sentiment_matcher,
+    "token": token_sentiment_engine
+}
+
+CREATED_ON_FORMAT = "%m/%d/%Y %H:%M"
+
+@functools.lru_cache(maxsize=1 << 16)
+def parse_created_on(value: str) -> datetime.datetime:
+    #Reviews cluster by minute so most rows are cache hits, misses split the fixed format by hand and only malformed values pay for strptime
+    date, _, time_of_day = value.partition(" ")
+    fields = date.split("/") + time_of_day.split(":")
+    if len(fields) == 5 and all(field.isascii() and field.isdigit() for field in fields):
+        month, day, year, hour, minute = fields
+        if len(year) == 4 and len(month) <= 2 and len(day) <= 2 and len(hour) <= 2 and len(minute) <= 2:
+            try:
+                return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute))
+            except ValueError:
+                pass
+    return datetime.datetime.strptime(value, CREATED_ON_FORMAT)
 
 class ChatGPTRating:
     pass
 
 class ChatGPTRating:
+    __slots__ = ("id", "username", "content", "score", "likes", "created_version", "created_on", "current_version", "sentiment")
     id:uuid.uuid4
     username:str
     content: str
@@ -325,23 +458,23 @@ class ChatGPTRating:
     
     def __init__(self, id:uuid.uuid4, username:str, content:str, score:int, likes:int, created_version:str, created_on:str, current_version:str, sentiment:str):
         self.id = id
-        self.username = username
+        self.username = sys.intern(username)
         self.content = content
         self.score = score
         self.likes = likes
-        self.created_version = created_version
+        self.created_version = sys.intern(created_version)
         self.created_on = created_on
-        self.current_version = current_version
+        self.current_version = sys.intern(current_version)
         self.sentiment = sentiment
-    
+
     def analyse_positive_sentiment(content: str) -> int:
         return sum(content.count(sentimental_word) for sentimental_word in SentimentKeywordLookup.POSITIVE)
     def analyse_negative_sentiment(content: str) -> int:
         return sum(content.count(sentimental_word) for sentimental_word in SentimentKeywordLookup.NEGATIVE)
-    def analyse_sentiment(content: str) -> float:
+    def analyse_sentiment(content: str, engine: str = "substring") -> float:
+        return ChatGPTRating.classify_sentiment(*sentiment_engines[engine].count(content))
+    def classify_sentiment(positive_sentiment: int, negative_sentiment: int) -> int:
         #Don't have time for proper unbiased analysis (this one's weighted in favour of positive)
-        positive_sentiment = ChatGPTRating.analyse_positive_sentiment(content)
-        negative_sentiment = ChatGPTRating.analyse_negative_sentiment(content)
         if negative_sentiment == 0:
             if positive_sentiment == 0:
                 return Sentiment.NEUTRAL
@@ -355,58 +488,757 @@ class ChatGPTRating:
             else:
                 return Sentiment.NEUTRAL
     
-    def from_row(row) -> ChatGPTRating:
-        return ChatGPTRating(
-            id = uuid.UUID(row[0]),
-            username = row[1],
-            content = row[2],
-            score = int(row[3]),
-            likes = int(row[4]),
-            created_version = row[5],
-            created_on = datetime.datetime.strptime(row[6], "%m/%d/%Y %H:%M"),
-            current_version = row[7],
-            sentiment = ChatGPTRating.analyse_sentiment(row[2].lower())
+    def parse_row(row, engine: str = "substring") -> tuple:
+        #Plain tuple in constructor order, cheap to pickle back from a worker process
+        return (
+            uuid.UUID(row[0]),
+            row[1],
+            row[2],
+            int(row[3]),
+            int(row[4]),
+            row[5],
+            parse_created_on(row[6]),
+            row[7],
+            ChatGPTRating.analyse_cached_sentiment(row[2].lower(), engine)
         )
+    def from_row(row, engine: str = "substring") -> ChatGPTRating:
+        return ChatGPTRating(*ChatGPTRating.parse_row(row, engine))
+    def analyse_cached_sentiment(content: str, engine: str = "substring") -> int:
+        if sentiment_cache is None:
+            return ChatGPTRating.analyse_sentiment(content, engine)
+        return sentiment_cache.analyse(content, engine)
+
+def sentiment_fingerprint(engine: str) -> bytes:
+    #Any edit to the keyword lists changes the fingerprint, so cached sentiments from older lists are never reused
+    keywords = json.dumps([engine, SentimentKeywordLookup.POSITIVE, SentimentKeywordLookup.NEGATIVE])
+    return hashlib.sha256(keywords.encode("utf-8")).digest()[:8]
+
+class SentimentCache:
+    #Keyed by a digest of the lowercased review, the exact text the scorers see
+    SCHEMA = "CREATE TABLE IF NOT EXISTS sentiment (fingerprint BLOB, digest BLOB, sentiment INTEGER, PRIMARY KEY (fingerprint, digest)) WITHOUT ROWID"
+    FLUSH_SIZE = 10000
+    maxsize: int
+    fingerprints: dict[str, bytes]
+    entries: collections.OrderedDict
+    pending: list[tuple[bytes, bytes, int]]
+    file_path: str
+    connection: sqlite3.Connection
+    reader: sqlite3.Connection
+    owner_pid: int
+
+    def __init__(self, maxsize: int = 1 << 16, file_path: str = None):
+        self.maxsize = maxsize
+        self.fingerprints = {engine: sentiment_fingerprint(engine) for engine in sentiment_engines}
+        self.entries = collections.OrderedDict()
+        self.pending = []
+        self.file_path = file_path
+        self.connection = None
+        self.reader = None
+        #Forked workers inherit this object but must not share the sqlite connection,
+        #they look up through a read-only connection of their own and hand their misses back to the owner
+        self.owner_pid = os.getpid()
+        if file_path is not None:
+            self.connection = sqlite3.connect(file_path)
+            self.connection.execute(SentimentCache.SCHEMA)
+            fingerprints = list(self.fingerprints.values())
+            self.connection.execute(f"DELETE FROM sentiment WHERE fingerprint NOT IN ({', '.join('?' * len(fingerprints))})", fingerprints)
+            self.connection.commit()
+
+    def has_store(self) -> bool:
+        return self.connection is not None and self.owner_pid == os.getpid()
+
+    def lookup_connection(self) -> sqlite3.Connection:
+        if self.owner_pid == os.getpid() or self.file_path is None:
+            return self.connection
+        if self.reader is None:
+            self.reader = sqlite3.connect(f"file:{urllib.parse.quote(self.file_path)}?mode=ro", uri=True)
+        return self.reader
+
+    def analyse(self, content: str, engine: str = "substring") -> int:
+        fingerprint = self.fingerprints[engine]
+        key = fingerprint + hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        sentiment = None
+        connection = self.lookup_connection()
+        if connection is not None:
+            row = connection.execute("SELECT sentiment FROM sentiment WHERE fingerprint = ? AND digest = ?", (fingerprint, key[len(fingerprint):])).fetchone()
+            if row is not None:
+                sentiment = row[0]
+        if sentiment is None:
+            sentiment = ChatGPTRating.analyse_sentiment(content, engine)
+            if connection is not None:
+                self.pending.append((fingerprint, key[len(fingerprint):], sentiment))
+                if len(self.pending) >= SentimentCache.FLUSH_SIZE:
+                    self.flush()
+        self.entries[key] = sentiment
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return sentiment
+
+    def take_pending(self) -> list[tuple[bytes, bytes, int]]:
+        pending, self.pending = self.pending, []
+        return pending
+
+    def store(self, entries: list[tuple[bytes, bytes, int]]):
+        #Misses scored by workers, written through the owner's connection
+        if self.has_store():
+            self.pending.extend(entries)
+            if len(self.pending) >= SentimentCache.FLUSH_SIZE:
+                self.flush()
+
+    def flush(self):
+        if self.has_store() and self.pending:
+            self.connection.executemany("INSERT OR REPLACE INTO sentiment VALUES (?, ?, ?)", self.pending)
+            self.connection.commit()
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        if self.has_store():
+            self.connection.close()
+            self.connection = None
+
+sentiment_cache = SentimentCache()
+
+def with_cache_misses(function, *args):
+    #Runs a chunk in a pool worker and returns what it scored without a cache hit, for the parent to store
+    result = function(*args)
+    return result, [] if sentiment_cache is None else sentiment_cache.take_pending()
+
+def store_cache_misses(future: concurrent.futures.Future):
+    result, misses = future.result()
+    if sentiment_cache is not None:
+        sentiment_cache.store(misses)
+    return result
 
-@timing
 def setup_reader(file_handler):
     reader = csv.reader(file_handler)
     next(reader)
     return reader
 
+CHUNK_BLOCK_SIZE = 1 << 20
+
+def find_record_end(file_handler, offset: int, quoted: bool) -> int:
+    #A newline only ends a record when it sits outside quotes, escaped "" toggles twice so parity is enough
+    file_handler.seek(offset)
+    while True:
+        block = file_handler.read(CHUNK_BLOCK_SIZE)
+        if not block:
+            return offset
+        position = 0
+        while True:
+            newline = block.find(b"\n", position)
+            if newline == -1:
+                quoted ^= block.count(b'"', position) & 1
+                offset += len(block)
+                break
+            quoted ^= block.count(b'"', position, newline) & 1
+            if not quoted:
+                return offset + newline + 1
+            position = newline + 1
+
+def count_quotes(file_handler, start: int, end: int) -> int:
+    file_handler.seek(start)
+    count = 0
+    while start < end:
+        block = file_handler.read(min(CHUNK_BLOCK_SIZE, end - start))
+        if not block:
+            break
+        count += block.count(b'"')
+        start += len(block)
+    return count
+
+def split_records(file_path: str, chunk_count: int) -> list[tuple[int, int]]:
+    size = os.path.getsize(file_path)
+    chunks: list[tuple[int, int]] = []
+    with open(file_path, "rb") as file_handler:
+        header_end = find_record_end(file_handler, 0, False)
+        chunk_size = max(1, (size - header_end) // chunk_count)
+        start = header_end
+        for index in range(1, chunk_count + 1):
+            if start >= size:
+                break
+            target = header_end + index * chunk_size
+            if index == chunk_count or target >= size:
+                end = size
+            elif target <= start:
+                continue
+            else:
+                end = find_record_end(file_handler, target, count_quotes(file_handler, start, target) & 1)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+def split_record(record: bytes) -> list[bytes]:
+    if b'"' not in record:
+        return record.split(b",")
+    fields = []
+    position = 0
+    length = len(record)
+    while True:
+        if position < length and record[position] == 34:
+            #Quoted field, a doubled "" is an escaped quote rather than the closing one
+            closing = record.find(b'"', position + 1)
+            while closing != -1 and record[closing + 1:closing + 2] == b'"':
+                closing = record.find(b'"', closing + 2)
+            if closing == -1:
+                closing = length
+            field = record[position + 1:closing].replace(b'""', b'"')
+            #Match the newline translation text mode open() applies inside quoted bodies
+            if b"\r" in field:
+                field = field.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            fields.append(field)
+            position = record.find(b",", closing)
+            if position == -1:
+                return fields
+            position += 1
+        else:
+            comma = record.find(b",", position)
+            if comma == -1:
+                fields.append(record[position:])
+                return fields
+            fields.append(record[position:comma])
+            position = comma + 1
+
+class MappedReviewReader:
+    #Finds records at the bytes level over an mmap and only decodes the projected columns
+    file_handler: io.BufferedReader
+    map: mmap.mmap
+    columns: tuple[int, ...]
+    position: int
+    end: int
+
+    def __init__(self, file_path: str, columns: tuple[int, ...] = tuple(range(8)), start: int = None, end: int = None):
+        self.file_handler = open(file_path, "rb")
+        size = os.path.getsize(file_path)
+        self.map = mmap.mmap(self.file_handler.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else None
+        self.columns = columns
+        self.position = find_record_end(self.file_handler, 0, False) if start is None else start
+        self.end = size if end is None else min(end, size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+        return False
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file_handler.close()
+
+    def __iter__(self):
+        data = self.map
+        columns = self.columns
+        end = self.end
+        position = self.position
+        while position < end:
+            newline = data.find(b"\n", position, end)
+            if newline == -1:
+                newline = end
+            record = data[position:newline]
+            while record.count(b'"') & 1 and newline < end:
+                newline = data.find(b"\n", newline + 1, end)
+                if newline == -1:
+                    newline = end
+                record = data[position:newline]
+            position = newline + 1
+            self.position = min(position, end)
+            if record.endswith(b"\r"):
+                record = record[:-1]
+            if not record:
+                continue
+            fields = split_record(record)
+            yield [fields[column].decode("utf-8") for column in columns]
+
+def read_ratings_chunk(file_path: str, start: int, end: int, engine: str = "substring") -> list[tuple]:
+    with MappedReviewReader(file_path, start=start, end=end) as reader:
+        return [ChatGPTRating.parse_row(row, engine) for row in reader]
+
 @timing
-def read_ratings(file_path:str) -> list[ChatGPTRating]:
-    with open(file_path, "r", encoding="utf-8") as file_handler:
-        return list(map(ChatGPTRating.from_row, setup_reader(file_handler)))
-    
+def read_ratings(file_path:str, engine: str = "substring", workers: int = 1) -> list[ChatGPTRating]:
+    if workers > 1:
+        #More chunks than workers so one slow chunk doesn't leave the other cores idle
+        chunks = split_records(file_path, workers * 4)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(with_cache_misses, read_ratings_chunk, file_path, start, end, engine) for start, end in chunks]
+            ratings = [ChatGPTRating(*fields) for future in futures for fields in store_cache_misses(future)]
+    else:
+        with open(file_path, "r", encoding="utf-8") as file_handler:
+            ratings = list(map(functools.partial(ChatGPTRating.from_row, engine=engine), setup_reader(file_handler)))
+    instrumentation.add_rows(len(ratings))
+    return ratings
+
+def iterate_ratings(file_path: str, engine: str = "substring"):
+    with open_reviews(file_path) as file_handler:
+        for row in setup_reader(file_handler):
+            yield ChatGPTRating.from_row(row, engine)
+
+encode_json_string = json.encoder.encode_basestring_ascii
+
+def encode_rating(rating: ChatGPTRating) -> str:
+    #Field by field instead of json.dumps(cls=...), UUIDs and datetimes never reach a default() fallback
+    return (
+        f'{{"id":"{rating.id}"'
+        f',"username":{encode_json_string(rating.username)}'
+        f',"content":{encode_json_string(rating.content)}'
+        f',"score":{rating.score}'
+        f',"likes":{rating.likes}'
+        f',"created_version":{encode_json_string(rating.created_version)}'
+        f',"created_on":"{rating.created_on.isoformat()}"'
+        f',"current_version":{encode_json_string(rating.current_version)}'
+        f',"sentiment":{rating.sentiment}}}'
+    )
+
+class RatingExporter:
+    FORMATS = ("json", "ndjson")
+    file_handler: io.TextIOBase
+    format: str
+    count: int
+
+    def __init__(self, file_handler: io.TextIOBase, format: str = "json"):
+        if format not in RatingExporter.FORMATS:
+            raise ValueError(f"Unknown export format: {format}")
+        self.file_handler = file_handler
+        self.format = format
+        self.count = 0
+
+    def add(self, rating: ChatGPTRating):
+        if self.format == "ndjson":
+            self.file_handler.write(encode_rating(rating) + "\n")
+        else:
+            self.file_handler.write(("[" if self.count == 0 else ",") + encode_rating(rating))
+        self.count += 1
+
+    def close(self):
+        if self.format == "json":
+            self.file_handler.write("]" if self.count > 0 else "[]")
+
 @timing
+def export_ratings(ratings, file_handler: io.TextIOBase, format: str = "json") -> int:
+    exporter = RatingExporter(file_handler, format)
+    for rating in ratings:
+        exporter.add(rating)
+    exporter.close()
+    instrumentation.add_rows(exporter.count)
+    return exporter.count
+
 def convert_ratings(ratings:list[ChatGPTRating]) -> str:
-    return json.dumps([rating.__dict__ for rating in ratings], cls=UUIDEncoder, indent=4)
+    file_handler = io.StringIO()
+    export_ratings(ratings, file_handler)
+    return file_handler.getvalue()
 
+class ParsedReview:
+    __slots__ = ("id", "content", "score", "likes", "created_version", "created_on", "current_version")
+    id: uuid.UUID
+    content: str
+    score: int
+    likes: int
+    created_version: str
+    created_on: datetime.datetime
+    current_version: str
+
+    def __init__(self, id: uuid.UUID, content: str, score: int, likes: int, created_version: str, created_on: datetime.datetime, current_version: str):
+        self.id = id
+        self.content = content
+        self.score = score
+        self.likes = likes
+        self.created_version = created_version
+        self.created_on = created_on
+        self.current_version = current_version
+
+class ScoredReview:
+    __slots__ = ("id", "score", "likes", "created_version", "created_on", "current_version", "sentiment")
+    id: uuid.UUID
+    score: int
+    likes: int
+    created_version: str
+    created_on: datetime.datetime
+    current_version: str
+    sentiment: int
+
+    def __init__(self, id: uuid.UUID, score: int, likes: int, created_version: str, created_on: datetime.datetime, current_version: str, sentiment: int):
+        self.id = id
+        self.score = score
+        self.likes = likes
+        self.created_version = created_version
+        self.created_on = created_on
+        self.current_version = current_version
+        self.sentiment = sentiment
+
+class MonthlySentimentCounter:
+    grouped_by_month: dict[tuple[int, int], list[int]]
+
+    def __init__(self, grouped_by_month: dict[tuple[int, int], list[int]] = None):
+        self.grouped_by_month = dict() if grouped_by_month is None else grouped_by_month
+
+    def add(self, entry):
+        key = (entry.created_on.year, entry.created_on.month)
+        if key in self.grouped_by_month:
+            self.grouped_by_month[key][entry.sentiment] += 1
+        else:
+            self.grouped_by_month[key] = [0, 0, 0]
+            self.grouped_by_month[key][entry.sentiment] = 1
+
+@timing
 def get_sentiment_by_month(data: list[ChatGPTRating]) -> list[list[int, int, int]]:
-    grouped_by_month = dict()
+    counter = MonthlySentimentCounter()
     for entry in data:
-        if (entry.created_on.year, entry.created_on.month) in grouped_by_month:
-            grouped_by_month[(entry.created_on.year, entry.created_on.month)][entry.sentiment] += 1
+        counter.add(entry)
+    instrumentation.add_rows(len(data))
+    return counter.grouped_by_month
+
+def open_reviews(file_path: str):
+    #"-" reads the CSV from stdin so reviews can be piped through the pipeline
+    if file_path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    return open(file_path, "r", encoding="utf-8")
+
+def parse_reviews(rows):
+    for row in rows:
+        yield ParsedReview(
+            id = uuid.UUID(row[0]),
+            content = row[2],
+            score = int(row[3]),
+            likes = int(row[4]),
+            created_version = row[5],
+            created_on = parse_created_on(row[6]),
+            current_version = row[7]
+        )
+
+def score_reviews(reviews, engine: str = "substring"):
+    #The review text is dropped here, nothing downstream of scoring holds on to it
+    for review in reviews:
+        yield ScoredReview(
+            id = review.id,
+            score = review.score,
+            likes = review.likes,
+            created_version = sys.intern(review.created_version),
+            created_on = review.created_on,
+            current_version = sys.intern(review.current_version),
+            sentiment = ChatGPTRating.analyse_cached_sentiment(review.content.lower(), engine)
+        )
+
+@timing
+def aggregate_reviews(reviews, aggregators: list) -> list:
+    #Pulls the whole generator pipeline, so parsing and scoring are timed here too
+    count = 0
+    for review in reviews:
+        for aggregator in aggregators:
+            aggregator.add(review)
+        count += 1
+    instrumentation.add_rows(count)
+    return aggregators
+
+class SentimentEntry:
+    __slots__ = ("created_on", "sentiment")
+    created_on: datetime.datetime
+    sentiment: int
+
+    def __init__(self, created_on: datetime.datetime, sentiment: int):
+        self.created_on = created_on
+        self.sentiment = sentiment
+
+def score_projected_reviews(rows, engine: str = "substring"):
+    #Rows projected down to (content, created_on), all the monthly counter needs
+    for content, created_on in rows:
+        yield SentimentEntry(parse_created_on(created_on), ChatGPTRating.analyse_cached_sentiment(content.lower(), engine))
+
+def sentiment_by_month_chunk(file_path: str, start: int, end: int, engine: str = "substring") -> dict[tuple[int, int], list[int]]:
+    with MappedReviewReader(file_path, (2, 6), start, end) as reader:
+        counter, = aggregate_reviews(score_projected_reviews(reader, engine), [MonthlySentimentCounter()])
+    return counter.grouped_by_month
+
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MINUTE = datetime.timedelta(minutes=1)
+
+def version_key(version: str) -> tuple[int, ...]:
+    #"1.2024.057" sorts as (1, 2024, 57), missing or odd parts sort first
+    return tuple(int(part) if part.isdigit() else -1 for part in version.split("."))
+
+class SentimentColumns:
+    #Columnar buffers for the vectorized aggregation, versions are dictionary encoded into one shared code table
+    GRANULARITIES = ("hour", "day", "week", "month", "created_version", "current_version")
+    minutes: array.array
+    sentiments: array.array
+    created_versions: array.array
+    current_versions: array.array
+    version_codes: dict[str, int]
+
+    def __init__(self):
+        self.minutes = array.array("q")
+        self.sentiments = array.array("b")
+        self.created_versions = array.array("i")
+        self.current_versions = array.array("i")
+        self.version_codes = dict()
+
+    def version_code(self, version: str) -> int:
+        code = self.version_codes.get(version)
+        if code is None:
+            code = self.version_codes[version] = len(self.version_codes)
+        return code
+
+    def add_values(self, minutes: int, sentiment: int, created_version: str, current_version: str):
+        self.minutes.append(minutes)
+        self.sentiments.append(sentiment)
+        self.created_versions.append(self.version_code(created_version))
+        self.current_versions.append(self.version_code(current_version))
+
+    def add(self, entry):
+        self.add_values((entry.created_on - EPOCH) // ONE_MINUTE, entry.sentiment, entry.created_version, entry.current_version)
+
+    def bucket(self, granularity: str) -> tuple[list, np.ndarray]:
+        #Bucket ids for one granularity, time buckets are contiguous so quiet periods still show up as zeros
+        minutes = np.frombuffer(self.minutes, dtype=np.int64)
+        if granularity in ("created_version", "current_version"):
+            #Codes follow first appearance, relabel them in release order so a rolling average runs across consecutive versions
+            codes = np.frombuffer(self.created_versions if granularity == "created_version" else self.current_versions, dtype=np.int32)
+            versions = sorted(self.version_codes, key=version_key)
+            ranks = np.zeros(len(versions), dtype=np.int64)
+            ranks[[self.version_codes[version] for version in versions]] = np.arange(len(versions))
+            return versions, ranks[codes]
+        if len(minutes) == 0:
+            return [], np.zeros(0, dtype=np.int64)
+        if granularity == "hour":
+            values = minutes // 60
+        elif granularity in ("day", "week"):
+            values = minutes // (60 * 24)
+            if granularity == "week":
+                #1970-01-01 was a Thursday, shift to the Monday starting each ISO week
+                values = (values - (values + 3) % 7) // 7
+        elif granularity == "month":
+            values = minutes.astype("datetime64[m]").astype("datetime64[M]").astype(np.int64)
         else:
-            grouped_by_month[(entry.created_on.year, entry.created_on.month)] = [0, 0, 0]
-            grouped_by_month[(entry.created_on.year, entry.created_on.month)][entry.sentiment] = 1
-    return grouped_by_month
-data = read_ratings("data/chatgpt_reviews.csv")
+            raise ValueError(f"Unknown granularity: {granularity}")
+        first = int(values.min())
+        ids = values - first
+        count = int(ids.max()) + 1
+        if granularity == "hour":
+            labels = [EPOCH + datetime.timedelta(hours=first + index) for index in range(count)]
+        elif granularity == "day":
+            labels = [(EPOCH + datetime.timedelta(days=first + index)).date() for index in range(count)]
+        elif granularity == "week":
+            labels = [tuple((EPOCH + datetime.timedelta(weeks=first + index, days=4)).isocalendar())[:2] for index in range(count)]
+        else:
+            labels = [(1970 + (first + index) // 12, (first + index) % 12 + 1) for index in range(count)]
+        return labels, ids
+
+    def counts(self, granularity: str) -> tuple[list, np.ndarray]:
+        labels, ids = self.bucket(granularity)
+        sentiments = np.frombuffer(self.sentiments, dtype=np.int8)
+        counts = np.bincount(ids * 3 + sentiments, minlength=len(labels) * 3)
+        return labels, counts.reshape(len(labels), 3)
+
+def rolling_average(counts: np.ndarray, window: int) -> np.ndarray:
+    #Trailing mean over the previous window buckets, the first few average over what exists so far
+    cumulative = np.vstack([np.zeros((1, counts.shape[1])), np.cumsum(counts, axis=0, dtype=np.float64)])
+    indices = np.arange(len(counts))
+    starts = np.maximum(indices + 1 - window, 0)
+    return (cumulative[indices + 1] - cumulative[starts]) / (indices + 1 - starts)[:, None]
+
+@timing
+def stream_sentiment_by_month(file_path: str, engine: str = "substring", workers: int = 1) -> dict[tuple[int, int], list[int]]:
+    if file_path == "-":
+        with open_reviews(file_path) as file_handler:
+            counter, = aggregate_reviews(score_reviews(parse_reviews(setup_reader(file_handler)), engine), [MonthlySentimentCounter()])
+        return counter.grouped_by_month
+    if workers <= 1:
+        return sentiment_by_month_chunk(file_path, None, None, engine)
+    counter = MonthlySentimentCounter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(with_cache_misses, sentiment_by_month_chunk, file_path, start, end, engine) for start, end in split_records(file_path, workers * 4)]
+        for future in futures:
+            for key, counts in store_cache_misses(future).items():
+                if key in counter.grouped_by_month:
+                    counter.grouped_by_month[key] = [total + count for total, count in zip(counter.grouped_by_month[key], counts)]
+                else:
+                    counter.grouped_by_month[key] = counts
+    return counter.grouped_by_month
+
+def read_record_blocks(file_handler, offset: int):
+    #Yields runs of newline-terminated records with the offset just past them and True.
+    #A last record without its newline is yielded with the offset before it and False when its quotes are balanced,
+    #an unbalanced one is still being written and waits for the next run
+    file_handler.seek(offset)
+    pending = b""
+    pending_quoted = False
+    while True:
+        block = file_handler.read(CHUNK_BLOCK_SIZE)
+        if not block:
+            if pending.strip() and not pending_quoted:
+                yield pending, offset, False
+            return
+        quoted = pending_quoted
+        last_newline = -1
+        position = 0
+        while True:
+            newline = block.find(b"\n", position)
+            if newline == -1:
+                break
+            quoted ^= block.count(b'"', position, newline) & 1
+            if not quoted:
+                last_newline = newline
+            position = newline + 1
+        if last_newline == -1:
+            pending += block
+            pending_quoted = quoted ^ (block.count(b'"', position) & 1)
+            continue
+        records = pending + block[:last_newline + 1]
+        pending = block[last_newline + 1:]
+        pending_quoted = bool(pending.count(b'"') & 1)
+        offset += len(records)
+        yield records, offset, True
+
+CHECKPOINT_DIGEST_SIZE = 1 << 16
+
+def digest_range(file_handler, start: int, end: int) -> str:
+    file_handler.seek(start)
+    return hashlib.sha256(file_handler.read(end - start)).hexdigest()
+
+def read_checkpoint(checkpoint_path: str, file_handler, size: int, engine: str) -> dict:
+    #Anything that doesn't prove the file only grew since the last run means rebuilding from scratch.
+    #Only the first and last CHECKPOINT_DIGEST_SIZE bytes before the offset are hashed, so an edit in between
+    #that keeps the size is not noticed, delete the checkpoint after rewriting reviews in place
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r", encoding="utf-8") as checkpoint_handler:
+        checkpoint = json.load(checkpoint_handler)
+    offset = checkpoint["offset"]
+    if checkpoint["fingerprint"] != sentiment_fingerprint(engine).hex() or size < offset:
+        return None
+    #Reviews start after the header's newline, an offset inside the header would parse it as a review
+    if checkpoint.get("header_end", 0) <= 0 or offset < checkpoint["header_end"]:
+        return None
+    if checkpoint["head_digest"] != digest_range(file_handler, 0, min(offset, CHECKPOINT_DIGEST_SIZE)):
+        return None
+    if checkpoint["tail_digest"] != digest_range(file_handler, max(0, offset - CHECKPOINT_DIGEST_SIZE), offset):
+        return None
+    return checkpoint
+
+def write_checkpoint(checkpoint_path: str, file_handler, header_end: int, offset: int, engine: str, grouped_by_month: dict[tuple[int, int], list[int]]):
+    checkpoint = {
+        "header_end": header_end,
+        "offset": offset,
+        "fingerprint": sentiment_fingerprint(engine).hex(),
+        "head_digest": digest_range(file_handler, 0, min(offset, CHECKPOINT_DIGEST_SIZE)),
+        "tail_digest": digest_range(file_handler, max(0, offset - CHECKPOINT_DIGEST_SIZE), offset),
+        "grouped_by_month": [[year, month, *counts] for (year, month), counts in grouped_by_month.items()]
+    }
+    with open(checkpoint_path + ".tmp", "w", encoding="utf-8") as checkpoint_handler:
+        json.dump(checkpoint, checkpoint_handler)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+@timing
+def update_sentiment_by_month(file_path: str, checkpoint_path: str, engine: str = "substring") -> dict[tuple[int, int], list[int]]:
+    with open(file_path, "rb") as file_handler:
+        checkpoint = read_checkpoint(checkpoint_path, file_handler, os.path.getsize(file_path), engine)
+        if checkpoint is None:
+            header_end = offset = find_record_end(file_handler, 0, False)
+            counter = MonthlySentimentCounter()
+            file_handler.seek(max(0, header_end - 1))
+            if file_handler.read(1) != b"\n":
+                #No complete header yet, nothing to count and nothing safe to resume from
+                return counter.grouped_by_month
+        else:
+            header_end = checkpoint["header_end"]
+            offset = checkpoint["offset"]
+            counter = MonthlySentimentCounter({(year, month): counts for year, month, *counts in checkpoint["grouped_by_month"]})
+        checkpointed = False
+        for records, offset, terminated in read_record_blocks(file_handler, offset):
+            if not terminated:
+                #Counted in this run, but the checkpoint stays before it so it's read again once its newline arrives
+                write_checkpoint(checkpoint_path, file_handler, header_end, offset, engine, counter.grouped_by_month)
+                checkpointed = True
+            with io.TextIOWrapper(io.BytesIO(records), encoding="utf-8") as text_handler:
+                aggregate_reviews(score_reviews(parse_reviews(csv.reader(text_handler)), engine), [counter])
+        if not checkpointed:
+            write_checkpoint(checkpoint_path, file_handler, header_end, offset, engine, counter.grouped_by_month)
+    return counter.grouped_by_month
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs="?", default="data/chatgpt_reviews.csv")
+    parser.add_argument("--sentiment-engine", choices=sentiment_engines.keys(), default="substring")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--export")
+    parser.add_argument("--export-format", choices=RatingExporter.FORMATS, default="json")
+    parser.add_argument("--sentiment-cache")
+    parser.add_argument("--checkpoint")
+    parser.add_argument("--granularity", nargs="+", choices=SentimentColumns.GRANULARITIES, default=[])
+    parser.add_argument("--rolling", type=int, default=1)
+    parser.add_argument("--render-workers", type=int, default=1)
+    parser.add_argument("--render-cache", default="graphs/.render_cache.json")
+    parser.add_argument("--force-render", action="store_true")
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--profile-report")
+    parser.add_argument("--profile-memory", action="store_true")
+    arguments = parser.parse_args()
+
+    if arguments.profile or arguments.profile_memory or arguments.profile_report is not None:
+        instrumentation.enable(arguments.profile_report, arguments.profile_memory)
+
+    if arguments.sentiment_cache is not None:
+        sentiment_cache = SentimentCache(file_path=arguments.sentiment_cache)
+
+    if arguments.checkpoint is not None and arguments.granularity:
+        parser.error("--granularity needs every review, the checkpoint only reads what was appended")
+
+    streaming = arguments.stream or arguments.input == "-"
+    columns = SentimentColumns()
+    if arguments.checkpoint is not None:
+        grouped_by_month = update_sentiment_by_month(arguments.input, arguments.checkpoint, arguments.sentiment_engine)
+    elif streaming and arguments.export is None and not arguments.granularity:
+        grouped_by_month = stream_sentiment_by_month(arguments.input, arguments.sentiment_engine, arguments.workers)
+    else:
+        data = iterate_ratings(arguments.input, arguments.sentiment_engine) if streaming else read_ratings(arguments.input, arguments.sentiment_engine, arguments.workers)
+        counter = MonthlySentimentCounter()
+        #The granularity columns are filled by the same pass as the monthly counts, stdin can only be read once
+        aggregators = [counter, columns] if arguments.granularity else [counter]
+        if arguments.export is None:
+            aggregate_reviews(data, aggregators)
+        else:
+            #The exporter is just another aggregator, so a streamed export stays within bounded memory
+            with open(arguments.export, "w", encoding="utf-8") as export_handler:
+                exporter = RatingExporter(export_handler, arguments.export_format)
+                aggregate_reviews(data, aggregators + [exporter])
+                exporter.close()
+        grouped_by_month = counter.grouped_by_month
+    sentiment_cache.close()
                 
-#neutral = [entry.content for entry in data if ChatGPTRating.analyse_positive_sentiment(entry.content.lower()) == 0 and ChatGPTRating.analyse_negative_sentiment(entry.content.lower()) == 0]
-#print("\n".join(entry for entry in neutral))
-
-#print(len(neutral))
-#print([entry.created_on for entry in data])
-
-print(sorted(list(get_sentiment_by_month(data).items()), key=lambda x: x[0]))
-
-sentiment_by_month = sorted(list(get_sentiment_by_month(data).items()), key=lambda x: x[0])
-create_line_graph(
-    [
-        Line(("Positive", "Negative", "Neutral")[sentiment], [Point(index, entry[1][sentiment]) for index, entry in enumerate(sentiment_by_month)])
-        for sentiment in (Sentiment.POSITIVE, Sentiment.NEGATIVE, Sentiment.NEUTRAL)
-    ],
-    "graphs/3.3.png"
-)
\ No newline at end of file
+    #neutral = [entry.content for entry in data if ChatGPTRating.analyse_positive_sentiment(entry.content.lower()) == 0 and ChatGPTRating.analyse_negative_sentiment(entry.content.lower()) == 0]
+    #print("\n".join(entry for entry in neutral))
+
+    #print(len(neutral))
+    #print([entry.created_on for entry in data])
+
+    sentiment_by_month = sorted(list(grouped_by_month.items()), key=lambda x: x[0])
+    print(sentiment_by_month)
+
+    charts: list[rendering.Chart] = []
+    charts.append(rendering.line_chart(
+        [
+            Line(("Positive", "Negative", "Neutral")[sentiment], [Point(index, entry[1][sentiment]) for index, entry in enumerate(sentiment_by_month)])
+            for sentiment in (Sentiment.POSITIVE, Sentiment.NEGATIVE, Sentiment.NEUTRAL)
+        ],
+        "graphs/3.3.png"
+    ))
+
+    if arguments.granularity:
+        for granularity in arguments.granularity:
+            labels, counts = columns.counts(granularity)
+            averages = rolling_average(counts, arguments.rolling)
+            print(granularity, [(label, list(map(int, count)), list(map(float, average))) for label, count, average in zip(labels, counts, averages)])
+            charts.append(rendering.line_chart(
+                [
+                    Line(("Positive", "Negative", "Neutral")[sentiment], [Point(index, average[sentiment]) for index, average in enumerate(averages)])
+                    for sentiment in (Sentiment.POSITIVE, Sentiment.NEGATIVE, Sentiment.NEUTRAL)
+                ],
+                f"graphs/3.3.{granularity}.png"
+            ))
+
+    rendering.render_charts(charts, arguments.render_workers, arguments.render_cache, arguments.force_render)
@@ -0,0 +1,87 @@
+import os
+import json
+import hashlib
+import concurrent.futures
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import instrumentation
+from instrumentation import timing
+
+#Bumped when drawing code changes, so charts drawn by the old code stop matching
+RENDER_VERSION = 1
+
+class Chart:
+    kind: str
+    file_path: str
+    series: list
+    labels: tuple[str, str]
+    style: dict
+
+    def __init__(self, kind: str, file_path: str, series: list, labels: tuple[str, str] = ("", ""), style: dict = None):
+        self.kind = kind
+        self.file_path = file_path
+        self.series = series
+        self.labels = labels
+        self.style = dict() if style is None else style
+
+    def content_hash(self) -> str:
+        #Everything that ends up in the PNG: data, labels, style and the code and library drawing them
+        content = [RENDER_VERSION, matplotlib.__version__, self.kind, self.series, list(self.labels), self.style]
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+def line_chart(lines, file_path: str) -> Chart:
+    #Anything with .label and .points of .x/.y, both scripts' Line classes fit
+    return Chart("line", file_path, [[line.label, [float(point.x) for point in line.points], [float(point.y) for point in line.points]] for line in lines], style={"legend": "below"})
+
+def bar_chart(labels: tuple[str, str], bars, file_path: str) -> Chart:
+    return Chart("bar", file_path, [[bar.label, float(bar.value)] for bar in bars], labels)
+
+def draw_chart(chart: Chart):
+    #A Figure of its own on the Agg canvas, nothing goes through pyplot's global state so charts can be drawn side by side
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    match chart.kind:
+        case "line":
+            for label, xs, ys in chart.series:
+                axes.plot(xs, ys, label = label)
+            axes.legend(bbox_to_anchor=(0.5, -0.1), loc='upper center')
+            figure.savefig(chart.file_path, bbox_inches="tight")
+        case "bar":
+            axes.bar([label for label, _ in chart.series], [value for _, value in chart.series])
+            axes.set_xlabel(chart.labels[0])
+            axes.set_ylabel(chart.labels[1])
+            figure.savefig(chart.file_path)
+        case _:
+            raise ValueError(f"Unknown chart kind {chart.kind}")
+
+def read_render_cache(cache_path: str) -> dict[str, str]:
+    if cache_path is None or not os.path.exists(cache_path):
+        return dict()
+    with open(cache_path, "r", encoding="utf-8") as cache_handler:
+        return json.load(cache_handler)
+
+def write_render_cache(cache_path: str, rendered: dict[str, str]):
+    with open(cache_path + ".tmp", "w", encoding="utf-8") as cache_handler:
+        json.dump(rendered, cache_handler, indent=4)
+    os.replace(cache_path + ".tmp", cache_path)
+
+@timing
+def render_charts(charts: list[Chart], workers: int = 1, cache_path: str = None, force: bool = False) -> list[Chart]:
+    #Skips charts whose PNG exists and was drawn from the same content hash, draws the rest, returns what was drawn
+    rendered = read_render_cache(cache_path)
+    hashes = {chart.file_path: chart.content_hash() for chart in charts}
+    pending = [chart for chart in charts if force or rendered.get(chart.file_path) != hashes[chart.file_path] or not os.path.exists(chart.file_path)]
+    if workers > 1 and len(pending) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            for future in [executor.submit(draw_chart, chart) for chart in pending]:
+                future.result()
+    else:
+        for chart in pending:
+            draw_chart(chart)
+    if cache_path is not None:
+        rendered.update((chart.file_path, hashes[chart.file_path]) for chart in pending)
+        write_render_cache(cache_path, rendered)
+    instrumentation.add_rows(len(pending))
+    return pending